@@ -1,6 +1,5 @@
 import logging
 import sys
-import time
 
 import ndsi
 
@@ -38,13 +37,8 @@ n = ndsi.Network(callbacks=(on_network_event,))
 n.start()
 
 try:
-    while n.running:
-        if n.has_events:
-            n.handle_event()
-        for s in sensors.values():
-            if s.has_notifications:
-                s.handle_notification()
-        time.sleep(0.1)
+    # Handles network events and sensor notifications as soon as they arrive
+    n.run_forever()
 except (KeyboardInterrupt, SystemExit):
     n.stop()
     sys.exit()
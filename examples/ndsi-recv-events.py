@@ -1,5 +1,3 @@
-import time
-
 # https://github.com/pupil-labs/pyndsi/tree/v1.0
 import ndsi  # Main requirement
 
@@ -13,31 +11,23 @@ def main():
     network.start()
 
     try:
-        # Event loop, runs until interrupted
-        while network.running:
-            # Check for recently connected/disconnected devices
-            if network.has_events:
-                network.handle_event()
-
-            # Iterate over all connected devices
-            for event_sensor in SENSORS.values():
-                # Fetch recent sensor configuration changes,
-                # required for pyndsi internals
-                while event_sensor.has_notifications:
-                    event_sensor.handle_notification()
-
-                # Fetch recent event data
-                for event in event_sensor.fetch_data():
-                    # Output: EventValue(timestamp, label)
-                    print(event_sensor, event)
-
-            time.sleep(0.1)
+        # Event loop, runs until interrupted. Handles recently connected/disconnected
+        # devices and sensor configuration changes (required for pyndsi internals),
+        # and calls on_data() for every sensor with new data.
+        network.run_forever(on_data=on_data)
 
     # Catch interruption and disconnect gracefully
     except (KeyboardInterrupt, SystemExit):
         network.stop()
 
 
+def on_data(event_sensor):
+    # Fetch recent event data
+    for event in event_sensor.fetch_data():
+        # Output: EventValue(timestamp, label)
+        print(event_sensor, event)
+
+
 def on_network_event(network, event):
     # Handle event sensor attachment
     if event["subject"] == "attach" and event["sensor_type"] == EVENT_TYPE:
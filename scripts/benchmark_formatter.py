@@ -0,0 +1,78 @@
+"""
+Per-message decode times of the formatters with and without ndsi._fastformat.
+
+Usage: python scripts/benchmark_formatter.py [--number N]
+"""
+import argparse
+import struct
+import timeit
+
+import zmq
+
+import ndsi.formatter
+from ndsi.formatter import (
+    AnnotateDataFormatter,
+    DataFormat,
+    DataMessage,
+    EventDataFormatter,
+    GazeDataFormatter,
+    IMUDataFormatter,
+    VideoDataFormatter,
+)
+
+
+def benchmarks():
+    sensor_id = b"6678360f-9850-468e-8b44-47b7c43712dc"
+    ts = 1564499230219685300
+    gaze_msg = DataMessage(sensor_id, struct.pack("<Q", ts), struct.pack("<ff", 1, 2))
+    event_header = struct.pack("<qii", ts, 5, 0)
+    event_msg = DataMessage(sensor_id, event_header, zmq.Frame(b"start"))
+    imu_msg = DataMessage(sensor_id, b"", struct.pack("<Q6f", ts, *range(6)) * 80)
+    annotate_msg = DataMessage(struct.pack("<BQ", 1, ts), b"", b"")
+    video_header = struct.pack("<LLLLQLL", 0x10, 1280, 720, 1, ts, 0, 0)
+    video_msg = DataMessage(sensor_id, video_header, b"")
+
+    gaze = GazeDataFormatter.get_formatter(format=DataFormat.V4)
+    event = EventDataFormatter.get_formatter(format=DataFormat.V4)
+    imu = IMUDataFormatter.get_formatter(format=DataFormat.V4)
+    annotate = AnnotateDataFormatter.get_formatter(format=DataFormat.V4)
+    video = VideoDataFormatter.get_formatter(format=DataFormat.V4)
+    return {
+        "gaze V4": lambda: list(gaze.decode_msg(gaze_msg)),
+        "event V4": lambda: list(event.decode_msg(event_msg)),
+        "annotate V4": lambda: list(annotate.decode_msg(annotate_msg)),
+        "video V4 header": lambda: video._decode_header(video_msg),
+        "IMU V4 (80 samples)": lambda: list(imu.decode_msg(imu_msg)),
+        "gaze V4 batch (1 of 200)": lambda: gaze.decode_msgs_array([gaze_msg] * 200),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000)
+    args = parser.parse_args()
+
+    fastformat = ndsi.formatter._fastformat
+    backends = {"python": None}
+    if fastformat is not None:
+        backends["compiled"] = fastformat
+    else:
+        print("ndsi._fastformat is not available, only timing the Python backend")
+
+    print(f"{'message':<26}" + "".join(f"{name:>12}" for name in backends))
+    for name, decode in benchmarks().items():
+        times = {backend: float("inf") for backend in backends}
+        # alternate the backends, so that load changes affect both alike
+        for _ in range(3):
+            for backend, module in backends.items():
+                ndsi.formatter._fastformat = module
+                per_call = timeit.timeit(decode, number=args.number) / args.number
+                if "batch" in name:
+                    per_call /= 200
+                times[backend] = min(times[backend], per_call)
+        ndsi.formatter._fastformat = fastformat
+        print(f"{name:<26}" + "".join(f"{t * 1e6:>10.3f}us" for t in times.values()))
+
+
+if __name__ == "__main__":
+    main()
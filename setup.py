@@ -102,6 +102,8 @@ extensions = [
         extra_objects=extra_objects,
         language="c++",
     ),
+    Extension(name="ndsi.nal", sources=["src/ndsi/nal.pyx"]),
+    Extension(name="ndsi._fastformat", sources=["src/ndsi/_fastformat.pyx"]),
 ]
 
 setup(ext_modules=cythonize(extensions))
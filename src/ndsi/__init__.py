@@ -26,16 +26,19 @@ __protocol_version__ = str(DataFormat.latest().version_major)
 
 
 from ndsi import frame
+from ndsi.group import SensorGroup
 from ndsi.network import Network
-from ndsi.sensor import Sensor
+from ndsi.sensor import BackpressurePolicy, Sensor
 from ndsi.writer import H264Writer
 
 __all__ = [
     "__version__",
+    "BackpressurePolicy",
     "CaptureError",
     "frame",
     "H264Writer",
     "Network",
     "Sensor",
+    "SensorGroup",
     "StreamError",
 ]
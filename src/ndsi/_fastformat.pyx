@@ -0,0 +1,118 @@
+# cython: language_level=3
+'''
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+'''
+
+# Compiled header and body parsers for ndsi.formatter.
+#
+# Every function mirrors a struct.unpack based code path of the formatters and
+# returns identical values. The formatters fall back to those code paths if this
+# module is not available.
+
+import struct
+import sys
+
+from cpython.buffer cimport PyBUF_SIMPLE, PyBuffer_Release, PyObject_GetBuffer
+from libc.stdint cimport int32_t, int64_t, uint8_t, uint32_t, uint64_t
+from libc.string cimport memcpy
+
+if sys.byteorder != "little":
+    # the wire format is little-endian and copied as is
+    raise ImportError("ndsi._fastformat requires a little-endian platform")
+
+cdef double NANO = 1e-9
+
+
+cdef packed struct video_header_v3_t:
+    uint32_t format, width, height, index
+    double timestamp_s
+    uint32_t data_len, reserved
+
+cdef packed struct video_header_v4_t:
+    uint32_t format, width, height, index
+    uint64_t timestamp_ns
+    uint32_t data_len, reserved
+
+cdef packed struct gaze_body_v4_t:
+    float x, y
+
+cdef packed struct annotate_v3_t:
+    uint8_t key
+    double timestamp_s
+
+cdef packed struct annotate_v4_t:
+    uint8_t key
+    uint64_t timestamp_ns
+
+cdef packed struct event_header_v4_t:
+    int64_t timestamp_ns
+    int32_t body_length, encoding
+
+
+cdef int _unpack(obj, void *dest, Py_ssize_t size) except -1:
+    """Copies a buffer of exactly `size` bytes, like struct.unpack."""
+    cdef Py_buffer view
+    PyObject_GetBuffer(obj, &view, PyBUF_SIMPLE)
+    try:
+        if view.len != size:
+            raise struct.error('unpack requires a buffer of {} bytes'.format(size))
+        memcpy(dest, view.buf, size)
+    finally:
+        PyBuffer_Release(&view)
+    return 0
+
+
+def video_header_v3(header):
+    '''Video meta data of a V3 header, timestamp in microseconds.'''
+    cdef video_header_v3_t h
+    _unpack(header, &h, sizeof(h))
+    return (
+        h.format, h.width, h.height, h.index,
+        h.timestamp_s * 1e6, h.data_len, h.reserved,
+    )
+
+
+def video_header_v4(header):
+    '''Video meta data of a V4 header, timestamp in microseconds.'''
+    cdef video_header_v4_t h
+    _unpack(header, &h, sizeof(h))
+    return (
+        h.format, h.width, h.height, h.index,
+        <double>h.timestamp_ns / 1e3, h.data_len, h.reserved,
+    )
+
+
+def gaze_v4(header, body, value_type):
+    '''`value_type(x, y, timestamp)` of a V4 gaze message.'''
+    cdef uint64_t timestamp_ns
+    cdef gaze_body_v4_t b
+    _unpack(header, &timestamp_ns, sizeof(timestamp_ns))
+    _unpack(body, &b, sizeof(b))
+    return tuple.__new__(value_type, (b.x, b.y, timestamp_ns * NANO))
+
+
+def annotate_v3(data, value_type):
+    '''`value_type(key, timestamp)` of a V3 annotation.'''
+    cdef annotate_v3_t a
+    _unpack(data, &a, sizeof(a))
+    return tuple.__new__(value_type, (a.key, a.timestamp_s))
+
+
+def annotate_v4(data, value_type):
+    '''`value_type(key, timestamp)` of a V4 annotation.'''
+    cdef annotate_v4_t a
+    _unpack(data, &a, sizeof(a))
+    return tuple.__new__(value_type, (a.key, a.timestamp_ns * NANO))
+
+
+def event_header_v4(header):
+    '''(timestamp, body_length, encoding) of a V4 event header.'''
+    cdef event_header_v4_t h
+    _unpack(header, &h, sizeof(h))
+    return h.timestamp_ns * NANO, h.body_length, h.encoding
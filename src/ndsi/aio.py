@@ -0,0 +1,228 @@
+"""
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+
+asyncio interface, based on `zmq.asyncio`.
+
+    network = AsyncNetwork()
+    network.start()
+    async for event in network.events():
+        if event["subject"] == "attach" and event["sensor_type"] == "video":
+            sensor = network.sensor(event["sensor_uuid"])
+            await sensor.set_control_value("streaming", True)
+            async for frame in sensor.frames():
+                ...
+
+The wrapped `Network` and `Sensor` objects keep their sockets, which are awaited
+with a `zmq.asyncio.Poller` and only read once they are ready. Decoding runs in
+an executor, so that the event loop stays responsive.
+
+`zmq.asyncio.Poller` wraps synchronous sockets in new asyncio shadow sockets on
+every poll, which adds about 0.1 ms per socket to each poll, i.e. to every batch
+of messages. Registering the socket descriptors with `loop.add_reader()` instead
+would not work on event loops without `add_reader()`, e.g. the proactor event
+loop on Windows. Shadowing the sockets once is not an option either: their
+asyncio readers are not removed when `unlink()` closes the sockets while they
+are awaited.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import typing
+
+import zmq
+import zmq.asyncio
+
+from ndsi.formatter import DataFormat, DataMessage
+from ndsi.network import Network, NetworkEvent, NetworkSensor
+from ndsi.sensor import NotDataSubSupportedError, Sensor, VideoSensor
+
+# Interval in ms to check if the network was stopped or a sensor was unlinked
+POLL_INTERVAL = 100
+
+
+class AsyncSensor:
+    def __init__(
+        self,
+        sensor: Sensor,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+    ):
+        self.sensor = sensor
+        self._executor = executor
+
+    def __str__(self):
+        return f"<{__name__} {self.sensor}>"
+
+    @property
+    def name(self) -> str:
+        return self.sensor.name
+
+    @property
+    def uuid(self) -> str:
+        return self.sensor.uuid
+
+    @property
+    def type(self) -> str:
+        return self.sensor.type
+
+    @property
+    def controls(self) -> typing.Dict[str, typing.Any]:
+        return self.sensor.controls
+
+    @property
+    def linked(self) -> bool:
+        return not self.sensor.notify_sub.closed
+
+    def unlink(self):
+        self.sensor.unlink()
+
+    async def refresh_controls(self):
+        await self._wait_for_command_socket()
+        self.sensor.refresh_controls()
+
+    async def set_control_value(self, control_id, value):
+        await self._wait_for_command_socket()
+        self.sensor.set_control_value(control_id, value)
+
+    async def data(self) -> typing.AsyncIterator[typing.Any]:
+        """
+        Yields the decoded values of the sensor as they arrive. Notifications are
+        handled while iterating, which keeps `controls` up to date.
+        """
+        async for data_msgs in self._data_msgs():
+            values = await self._run_in_executor(self._decode, data_msgs, ())
+            for value in values:
+                yield value
+
+    async def frames(
+        self, conversions: typing.Iterable[str] = ("bgr",)
+    ) -> typing.AsyncIterator[typing.Any]:
+        """
+        Yields the frames of a video sensor like `data()`. `conversions` names the
+        frame properties (e.g. "bgr", "gray") that are computed in the executor as
+        well, see `VideoSensor.start_background_decoding`.
+        """
+        if not isinstance(self.sensor, VideoSensor):
+            raise TypeError(f"{self.sensor} is not a video sensor")
+        conversions = tuple(conversions)
+        async for data_msgs in self._data_msgs():
+            frames = await self._run_in_executor(self._decode, data_msgs, conversions)
+            for frame in frames:
+                if frame is not None:
+                    yield frame
+
+    async def _data_msgs(self) -> typing.AsyncIterator[typing.List[DataMessage]]:
+        sensor = self.sensor
+        if not sensor.supports_data_subscription:
+            raise NotDataSubSupportedError()
+        poller = zmq.asyncio.Poller()
+        poller.register(sensor.notify_sub, zmq.POLLIN)
+        poller.register(sensor.data_sub, zmq.POLLIN)
+        while self.linked:
+            if not sensor.has_data:
+                try:
+                    await poller.poll(timeout=POLL_INTERVAL)
+                except zmq.ZMQError:
+                    if self.linked:
+                        raise
+                if not self.linked:
+                    # unlinked while waiting
+                    return
+            while sensor.has_notifications:
+                sensor.handle_notification()
+            data_msgs = []
+            while sensor.has_data:
+                data_msgs.append(DataMessage(*sensor.get_data(copy=False)))
+            if data_msgs:
+                yield data_msgs
+
+    def _decode(self, data_msgs, conversions) -> list:
+        formatter = self.sensor.formatter
+        values = []
+        for data_msg in data_msgs:
+            for value in formatter.decode_msg(data_msg=data_msg):
+                if value is not None:
+                    for conversion in conversions:
+                        getattr(value, conversion)
+                values.append(value)
+        return values
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _wait_for_command_socket(self):
+        poller = zmq.asyncio.Poller()
+        poller.register(self.sensor.command_push, zmq.POLLOUT)
+        await poller.poll()
+
+
+class AsyncNetwork:
+    def __init__(
+        self,
+        formats: typing.Set[DataFormat] = None,
+        name=None,
+        headers=(),
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+    ):
+        """
+        `executor` runs the decoding of all linked sensors, by default the event
+        loop's default executor.
+        """
+        self._events = collections.deque()
+        self._executor = executor
+        self.network = Network(
+            formats=formats, name=name, headers=headers, callbacks=(self._on_event,)
+        )
+
+    @property
+    def running(self) -> bool:
+        return self.network.running
+
+    @property
+    def sensors(self) -> typing.Mapping[str, NetworkSensor]:
+        return self.network.sensors
+
+    def start(self):
+        self.network.start()
+
+    def stop(self):
+        self.network.stop()
+
+    def rejoin(self):
+        self.network.rejoin()
+
+    def sensor(self, sensor_uuid: str, **sensor_options) -> AsyncSensor:
+        """Links the sensor, see `Network.sensor`."""
+        sensor = self.network.sensor(sensor_uuid, **sensor_options)
+        return AsyncSensor(sensor, executor=self._executor)
+
+    async def events(self) -> typing.AsyncIterator[NetworkEvent]:
+        """Yields attach and detach events until the network is stopped."""
+        poller = zmq.asyncio.Poller()
+        for socket in self.network.event_sockets:
+            poller.register(socket, zmq.POLLIN)
+        while True:
+            while self._events:
+                yield self._events.popleft()
+            if not self.running:
+                return
+            try:
+                await poller.poll(timeout=POLL_INTERVAL)
+            except zmq.ZMQError:
+                if self.running:
+                    raise
+            while self.network.has_events:
+                self.network.handle_event()
+
+    def _on_event(self, caller, event):
+        self._events.append(event)
+
+
+__all__ = ["AsyncNetwork", "AsyncSensor"]
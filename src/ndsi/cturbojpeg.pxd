@@ -1,6 +1,6 @@
 # cython: language_level=3
 
-cdef extern from "turbojpeg.h":
+cdef extern from "turbojpeg.h" nogil:
     cdef enum TJSAMP:
         TJSAMP_444
         TJSAMP_422
@@ -46,7 +46,7 @@ cdef extern from "turbojpeg.h":
         TJXOP_ROT180
         TJXOP_ROT270
 
-    cdef struct tjscalingfactor:
+    ctypedef struct tjscalingfactor:
         int num
         int denom
 
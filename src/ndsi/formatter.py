@@ -2,6 +2,7 @@ import abc
 import enum
 import functools
 import struct
+import threading
 import typing
 
 import numpy as np
@@ -12,9 +13,16 @@ from ndsi.frame import (
     VIDEO_FRAME_FORMAT_MJPEG,
     FrameFactory,
     H264Frame,
+    H264Packet,
     JPEGFrame,
 )
 
+try:
+    from ndsi import _fastformat
+except ImportError:
+    # optional compiled parsers, the formatters fall back to struct
+    _fastformat = None
+
 __all__ = [
     "DataFormat",
     "DataFormatter",
@@ -92,6 +100,13 @@ class DataFormatter(typing.Generic[DataValue], abc.ABC):
     def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[DataValue]:
         pass
 
+    def decode_msgs_array(self, data_msgs: typing.Sequence[DataMessage]) -> np.ndarray:
+        """
+        Decodes several messages at once into a structured array with one record
+        per value. Only formatters of fixed-layout data support this.
+        """
+        raise NotImplementedError()
+
 
 ##########
 
@@ -112,65 +127,164 @@ class UnsupportedFormatter(DataFormatter[typing.Any]):
     def decode_msg(self, value: DataMessage) -> typing.Iterator[DataValue]:
         raise ValueError("Unsupported data format.")
 
+    def decode_msgs_array(self, data_msgs: typing.Sequence[DataMessage]) -> np.ndarray:
+        raise ValueError("Unsupported data format.")
+
 
 ##########
 
 
-VideoValue = typing.Union[JPEGFrame, H264Frame]
+VideoValue = typing.Union[JPEGFrame, H264Frame, H264Packet]
 
 
 class VideoDataFormatter(DataFormatter[VideoValue]):
-    def __init__(self):
+    """
+    Video formatters hold decoder state and must not be shared between sensors.
+    `get_formatter` always returns a new instance. Use `acquire_formatter` and
+    `release_formatter` to reuse decoder contexts of unlinked sensors.
+
+    `decoder_options` are passed on to `FrameFactory`, e.g.
+    `h264_color_format=ndsi.frame.H264_COLOR_FORMAT_NATIVE`.
+    """
+
+    POOL_SIZE_PER_FORMAT = 4
+
+    _pool: typing.Dict[typing.Hashable, typing.List["VideoDataFormatter"]] = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, **decoder_options):
         super().__init__()
-        self._frame_factory = FrameFactory()
+        self._frame_factory = FrameFactory(**decoder_options)
         self._newest_h264_frame = None
+        self._pool_key = None
+        self.passthrough = False
 
     def reset(self):
         self._newest_h264_frame = None
+        self._frame_factory.reset()
+        self._frame_factory.gray_only = False
+        self.passthrough = False
+
+    @property
+    def gray_only(self) -> bool:
+        """If set, MJPEG frames only decode luminance, see `JPEGFrame`."""
+        return self._frame_factory.gray_only
+
+    @gray_only.setter
+    def gray_only(self, value: bool):
+        self._frame_factory.gray_only = value
 
     @staticmethod
-    @functools.lru_cache(maxsize=1, typed=True)
     def get_formatter(
-        format: DataFormat,
+        format: DataFormat, **decoder_options
     ) -> typing.Union["VideoDataFormatter", UnsupportedFormatter]:
         if format == DataFormat.V3:
-            return _VideoDataFormatter_V3()
-        if format == DataFormat.V4:
-            return _VideoDataFormatter_V4()
-        raise ValueError(format)
+            formatter = _VideoDataFormatter_V3(**decoder_options)
+        elif format == DataFormat.V4:
+            formatter = _VideoDataFormatter_V4(**decoder_options)
+        else:
+            raise ValueError(format)
+        formatter._pool_key = (format, frozenset(decoder_options.items()))
+        return formatter
+
+    @staticmethod
+    def acquire_formatter(
+        format: DataFormat, **decoder_options
+    ) -> typing.Union["VideoDataFormatter", UnsupportedFormatter]:
+        """
+        Returns an unused formatter with the same decoder options from the pool or
+        creates a new one.
+        """
+        pool_key = (format, frozenset(decoder_options.items()))
+        with VideoDataFormatter._pool_lock:
+            pooled = VideoDataFormatter._pool.get(pool_key)
+            if pooled:
+                return pooled.pop()
+        return VideoDataFormatter.get_formatter(format=format, **decoder_options)
+
+    @staticmethod
+    def release_formatter(formatter: "VideoDataFormatter"):
+        """
+        Resets the formatter and returns it to the pool. The formatter must not be
+        used by the caller afterwards.
+        """
+        formatter.reset()
+        with VideoDataFormatter._pool_lock:
+            pooled = VideoDataFormatter._pool.setdefault(formatter._pool_key, [])
+            if len(pooled) < VideoDataFormatter.POOL_SIZE_PER_FORMAT:
+                pooled.append(formatter)
 
     def encode_msg(self, value: VideoValue) -> DataMessage:
         raise NotImplementedError()
 
+    def skip_msg(self, data_msg: DataMessage):
+        """
+        Consumes a message whose frames are not going to be used, e.g. because a
+        newer message is already available. H264 packets still pass through the
+        decoder to keep its reference frames, but non-reference frames are not
+        decoded and no output is converted.
+        """
+        if self.passthrough:
+            return
+        meta_data = self._decode_header(data_msg)
+        if meta_data[0] == VIDEO_FRAME_FORMAT_H264:
+            self._frame_factory.skip_h264_packet(data_msg.body, meta_data)
+
+    @abc.abstractmethod
+    def _decode_header(self, data_msg: DataMessage) -> tuple:
+        pass
+
+    def _decode_h264(
+        self, buffer_, meta_data
+    ) -> typing.Iterator[typing.Union[H264Frame, H264Packet]]:
+        if self.passthrough:
+            yield self._frame_factory.create_h264_packet(buffer_, meta_data)
+            return
+        frames = self._frame_factory.create_h264_frames(buffer_, meta_data)
+        decoded_any = False
+        for frame in frames:
+            decoded_any = True
+            self._newest_h264_frame = frame
+            yield frame
+        if not decoded_any:
+            # Decoder did not output a frame for this packet, repeat the newest one
+            yield self._newest_h264_frame
+
 
 class _VideoDataFormatter_V3(VideoDataFormatter):
-    def decode_msg(self, data_msg: DataMessage) -> VideoValue:
+    def _decode_header(self, data_msg: DataMessage) -> tuple:
+        if _fastformat is not None:
+            return _fastformat.video_header_v3(data_msg.header)
         meta_data = struct.unpack("<LLLLdLL", data_msg.header)
         meta_data_mutable = list(meta_data)
         meta_data_mutable[4] *= 1e6  # Convert timestamp s -> us
-        meta_data = tuple(meta_data_mutable)
+        return tuple(meta_data_mutable)
+
+    def decode_msg(self, data_msg: DataMessage) -> VideoValue:
+        meta_data = self._decode_header(data_msg)
         if meta_data[0] == VIDEO_FRAME_FORMAT_MJPEG:
             yield self._frame_factory.create_jpeg_frame(data_msg.body, meta_data)
         elif meta_data[0] == VIDEO_FRAME_FORMAT_H264:
-            frame = self._frame_factory.create_h264_frame(data_msg.body, meta_data)
-            self._newest_h264_frame = frame or self._newest_h264_frame
-            yield self._newest_h264_frame
+            yield from self._decode_h264(data_msg.body, meta_data)
         else:
             raise StreamError("Frame was not of format MJPEG or H264")
 
 
 class _VideoDataFormatter_V4(VideoDataFormatter):
-    def decode_msg(self, data_msg: DataMessage) -> VideoValue:
+    def _decode_header(self, data_msg: DataMessage) -> tuple:
+        if _fastformat is not None:
+            return _fastformat.video_header_v4(data_msg.header)
         meta_data = struct.unpack("<LLLLQLL", data_msg.header)
         meta_data_mutable = list(meta_data)
         meta_data_mutable[4] /= 1e3  # Convert timestamp ns -> us
-        meta_data = tuple(meta_data_mutable)
+        return tuple(meta_data_mutable)
+
+    def decode_msg(self, data_msg: DataMessage) -> VideoValue:
+        meta_data = self._decode_header(data_msg)
         if meta_data[0] == VIDEO_FRAME_FORMAT_MJPEG:
             yield self._frame_factory.create_jpeg_frame(data_msg.body, meta_data)
         elif meta_data[0] == VIDEO_FRAME_FORMAT_H264:
-            frame = self._frame_factory.create_h264_frame(data_msg.body, meta_data)
-            self._newest_h264_frame = frame or self._newest_h264_frame
-            yield self._newest_h264_frame
+            yield from self._decode_h264(data_msg.body, meta_data)
         else:
             raise StreamError("Frame was not of format MJPEG or H264")
 
@@ -203,6 +317,9 @@ class AnnotateDataFormatter(DataFormatter[AnnotateValue]):
 class _AnnotateDataFormatter_V3(AnnotateDataFormatter):
     def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[AnnotateValue]:
         # NOTE: Annotation sensor is currently not NDSI-conformant.
+        if _fastformat is not None:
+            yield _fastformat.annotate_v3(data_msg[0], AnnotateValue)
+            return
         key, ts = struct.unpack("<Bd", data_msg[0])
         yield AnnotateValue(key=key, timestamp=ts)
 
@@ -210,6 +327,9 @@ class _AnnotateDataFormatter_V3(AnnotateDataFormatter):
 class _AnnotateDataFormatter_V4(AnnotateDataFormatter):
     def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[AnnotateValue]:
         # NOTE: Annotation sensor is currently not NDSI-conformant.
+        if _fastformat is not None:
+            yield _fastformat.annotate_v4(data_msg[0], AnnotateValue)
+            return
         key, ts = struct.unpack("<BQ", data_msg[0])
         ts *= NANO
         yield AnnotateValue(key=key, timestamp=ts)
@@ -236,17 +356,34 @@ class GazeDataFormatter(DataFormatter[GazeValue]):
             return _GazeDataFormatter_V4()
         raise ValueError(format)
 
+    # one record per value, fields like GazeValue
+    ARRAY_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("timestamp", "<f8")])
+
     def encode_msg(self, value: GazeValue) -> DataMessage:
         raise NotImplementedError()
 
 
 class _GazeDataFormatter_V4(GazeDataFormatter):
     def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[GazeValue]:
+        if _fastformat is not None:
+            yield _fastformat.gaze_v4(data_msg.header, data_msg.body, GazeValue)
+            return
         (ts,) = struct.unpack("<Q", data_msg.header)
         ts *= NANO
         x, y = struct.unpack("<ff", data_msg.body)
         yield GazeValue(x=x, y=y, timestamp=ts)
 
+    def decode_msgs_array(self, data_msgs: typing.Sequence[DataMessage]) -> np.ndarray:
+        headers = np.frombuffer(b"".join(msg.header for msg in data_msgs), "<u8")
+        bodies = np.frombuffer(b"".join(msg.body for msg in data_msgs), "<f4")
+        if len(headers) != len(data_msgs) or len(bodies) != 2 * len(data_msgs):
+            raise ValueError("Gaze messages of unexpected size")
+        values = np.empty(len(data_msgs), dtype=self.ARRAY_DTYPE)
+        values["timestamp"] = headers * NANO
+        values["x"] = bodies[0::2]
+        values["y"] = bodies[1::2]
+        return values
+
 
 ##########
 
@@ -273,9 +410,42 @@ class IMUDataFormatter(DataFormatter[IMUValue]):
             return _IMUDataFormatter_V4()
         raise ValueError(format)
 
+    # one record per sample, fields like IMUValue
+    ARRAY_DTYPE = np.dtype(
+        [
+            ("timestamp", "<f8"),
+            ("accel_x", "<f4"),
+            ("accel_y", "<f4"),
+            ("accel_z", "<f4"),
+            ("gyro_x", "<f4"),
+            ("gyro_y", "<f4"),
+            ("gyro_z", "<f4"),
+        ]
+    )
+
     def encode_msg(self, value: IMUValue) -> DataMessage:
         raise NotImplementedError()
 
+    def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[IMUValue]:
+        for imu_frame in self.decode_msg_array(data_msg):
+            yield IMUValue(*imu_frame)
+
+    def decode_msg_array(self, data_msg: DataMessage) -> np.ndarray:
+        """
+        Returns the samples of a message as structured array of `ARRAY_DTYPE`.
+        """
+        return self._decode_body_array(data_msg.body)
+
+    def decode_msgs_array(self, data_msgs: typing.Sequence[DataMessage]) -> np.ndarray:
+        """
+        Returns the samples of several messages as one array of `ARRAY_DTYPE`.
+        """
+        return self._decode_body_array(b"".join(msg.body for msg in data_msgs))
+
+    @abc.abstractmethod
+    def _decode_body_array(self, body) -> np.ndarray:
+        pass
+
 
 class _IMUDataFormatter_V3(IMUDataFormatter):
     CONTENT_DTYPE = np.dtype(
@@ -290,12 +460,10 @@ class _IMUDataFormatter_V3(IMUDataFormatter):
         ]
     )
 
-    def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[IMUValue]:
-        content = np.frombuffer(data_msg.body, dtype=self.CONTENT_DTYPE).view(
-            np.recarray
-        )
-        for imu_frame in content:
-            yield IMUValue(*imu_frame)
+    def _decode_body_array(self, body) -> np.ndarray:
+        # same layout, only the timestamp field is named differently
+        content = np.frombuffer(body, dtype=self.CONTENT_DTYPE)
+        return content.view(self.ARRAY_DTYPE).copy()
 
 
 class _IMUDataFormatter_V4(IMUDataFormatter):
@@ -311,14 +479,13 @@ class _IMUDataFormatter_V4(IMUDataFormatter):
         ]
     )
 
-    def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[IMUValue]:
-        content = np.frombuffer(data_msg.body, dtype=self.CONTENT_DTYPE).view(
-            np.recarray
-        )
-        for imu_frame in content:
-            ts, *data = imu_frame
-            ts *= NANO
-            yield IMUValue(ts, *data)
+    def _decode_body_array(self, body) -> np.ndarray:
+        content = np.frombuffer(body, dtype=self.CONTENT_DTYPE)
+        samples = np.empty(len(content), dtype=self.ARRAY_DTYPE)
+        samples["timestamp"] = content["time_ns"] * NANO
+        for name in self.ARRAY_DTYPE.names[1:]:
+            samples[name] = content[name]
+        return samples
 
 
 ##########
@@ -341,12 +508,18 @@ class EventDataFormatter(DataFormatter[EventValue]):
             return _EventDataFormatter_V4()
         raise ValueError(format)
 
+    # one record per value, fields like EventValue
+    ARRAY_DTYPE = np.dtype([("timestamp", "<f8"), ("label", object)])
+
     def encode_msg(self, value: EventValue) -> DataMessage:
         raise NotImplementedError()
 
 
 class _EventDataFormatter_V4(EventDataFormatter):
     _encoding_lookup = {0: "utf-8"}
+    HEADER_DTYPE = np.dtype(
+        [("timestamp", "<i8"), ("body_length", "<i4"), ("encoding", "<i4")]
+    )
 
     def decode_msg(self, data_msg: DataMessage) -> typing.Iterator[EventValue]:
         """
@@ -359,9 +532,29 @@ class _EventDataFormatter_V4(EventDataFormatter):
         3. body:
             - `encoding_le` encoded string of length `body_length_le`
         """
-        ts, len_, enc_code = struct.unpack("<qii", data_msg.header)
-        ts *= NANO
+        if _fastformat is not None:
+            ts, len_, enc_code = _fastformat.event_header_v4(data_msg.header)
+        else:
+            ts, len_, enc_code = struct.unpack("<qii", data_msg.header)
+            ts *= NANO
         enc = self._encoding_lookup[enc_code]
         body = data_msg.body.bytes[:len_]
         label = body.decode(enc)
         yield EventValue(label=label, timestamp=ts)
+
+    def decode_msgs_array(self, data_msgs: typing.Sequence[DataMessage]) -> np.ndarray:
+        headers = np.frombuffer(
+            b"".join(msg.header for msg in data_msgs), dtype=self.HEADER_DTYPE
+        )
+        if len(headers) != len(data_msgs):
+            raise ValueError("Event messages of unexpected size")
+        values = np.empty(len(data_msgs), dtype=self.ARRAY_DTYPE)
+        values["timestamp"] = headers["timestamp"] * NANO
+        # labels have variable length and are decoded one by one
+        values["label"] = [
+            bytes(memoryview(msg.body)[:len_]).decode(self._encoding_lookup[enc_code])
+            for msg, len_, enc_code in zip(
+                data_msgs, headers["body_length"].tolist(), headers["encoding"].tolist()
+            )
+        ]
+        return values
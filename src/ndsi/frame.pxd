@@ -13,31 +13,63 @@ cimport ndsi.cturbojpeg as turbojpeg
 from ndsi.h264 cimport COLOR_FORMAT_YUV422, H264Decoder
 
 
+cdef class H264Frame
+
+
+cdef class BufferPool:
+    cdef dict _free  # idle buffers by size in bytes
+    cdef readonly Py_ssize_t max_bytes, pooled_bytes, hits, misses
+
+    cdef acquire(self, shape)
+    cdef release(self, buffer_)
+
+
 cdef class FrameFactory:
     cdef H264Decoder *decoder
     cdef turbojpeg.tjhandle tj_context
+    cdef public bint gray_only
+    cdef readonly BufferPool buffer_pool
+
+    cdef _decode_h264_packet(self, buffer_, meta_data)
+    cdef H264Frame _pop_h264_frame(self, buffer_, meta_data)
 
 cdef class JPEGFrame:
-    cdef turbojpeg.tjhandle tj_context
     #we use numpy for memory management.
-    cdef object _raw_data
-    cdef unsigned char[:] _bgr_buffer, _gray_buffer,_yuv_buffer
+    cdef object _raw_data  # keeps the memory behind _jpeg_buffer alive
+    cdef const unsigned char[::1] _jpeg_buffer
+    cdef object _yuv_buffer  # np.ndarray, owns its memory
     cdef long _width, _height, _index, _buffer_len
-    cdef bint _yuv_converted, _bgr_converted
+    cdef bint _yuv_converted
     cdef public double timestamp
     cdef public yuv_subsampling
+    cdef public bint gray_only
+    cdef dict _packed_cache  # packed images by (TJPF, scale num, scale denom)
+    cdef BufferPool _pool
 
-    cdef yuv2bgr(self)
     cdef jpeg2yuv(self)
+    cdef unsigned char *_jpeg_ptr(self)
+    cdef _packed(self, int pixel_format)
+    cdef _scaled(self, int pixel_format, scale)
+    cdef _packed_into(self, int pixel_format, out)
+    cdef _yuv2packed(self, int pixel_format, out=*)
+    cdef _decompress(self, int pixel_format, int num, int denom, out=*)
 
     cdef attach_tj_context(self, turbojpeg.tjhandle ctx)
+    cdef _release_buffers(self)
 
 cdef class H264Frame:
-    cdef turbojpeg.tjhandle tj_context
-    cdef unsigned char[:] _yuv_buffer, _bgr_buffer, _gray_buffer, _h264_buffer
+    cdef object _yuv_buffer, _bgr_buffer  # np.ndarray, own their memory
+    cdef const unsigned char[:] _h264_buffer
     cdef long _width, _height, _index, _buffer_len
     cdef bint _bgr_converted
     cdef public double timestamp
+    cdef public yuv_subsampling
+    cdef BufferPool _pool
 
-    cdef attach_tj_context(self, turbojpeg.tjhandle ctx)
-    cdef yuv2bgr(self)
+    cdef yuv2bgr(self, unsigned char[::1] bgr_buffer)
+    cdef _release_bgr_buffer(self)
+
+cdef class H264Packet:
+    cdef const unsigned char[:] _h264_buffer
+    cdef long _width, _height, _index
+    cdef public double timestamp
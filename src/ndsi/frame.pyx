@@ -11,14 +11,35 @@
 
 import hashlib
 import logging
+import threading
+from fractions import Fraction
 
+cimport cython
 cimport numpy as np
 from libc.stdint cimport int64_t, uint64_t
 from libc.string cimport memset
 
 import numpy as np
 
-from ndsi.h264 cimport get_vop_type_annexb
+from ndsi.h264 cimport (
+    AV_PIX_FMT_YUV420P,
+    AV_PIX_FMT_YUV422P,
+    AV_PIX_FMT_YUV444P,
+    AV_PIX_FMT_YUVJ420P,
+    AV_PIX_FMT_YUVJ422P,
+    AV_PIX_FMT_YUVJ444P,
+    COLOR_FORMAT_NATIVE,
+    COLOR_FORMAT_YUV420,
+    FF_THREAD_FRAME,
+    FF_THREAD_SLICE,
+    AVPixelFormat,
+    color_format_t,
+)
+from ndsi.nal cimport annexb_is_idr
+
+
+cdef extern from "Python.h":
+    Py_ssize_t Py_REFCNT(object o)
 
 # logging
 logger = logging.getLogger(__name__)
@@ -50,50 +71,350 @@ VIDEO_FRAME_FORMAT_MJPEG       = 0x10
 VIDEO_FRAME_FORMAT_H264        = 0x12
 VIDEO_FRAME_FORMAT_VP8         = 0x13
 
+# H264 output formats of FrameFactory
+H264_COLOR_FORMAT_YUV420       = COLOR_FORMAT_YUV420
+H264_COLOR_FORMAT_YUV422       = COLOR_FORMAT_YUV422
+# planar YUV as decoded, i.e. no chroma resampling
+H264_COLOR_FORMAT_NATIVE       = COLOR_FORMAT_NATIVE
+
+# H264 decoder threading of FrameFactory
+# frame threading requires one complete frame per packet and
+# delays the output by h264_thread_count - 1 frames
+H264_THREAD_FRAME              = FF_THREAD_FRAME
+H264_THREAD_SLICE              = FF_THREAD_SLICE
+
+# idle frame buffers kept by a FrameFactory, a few 1080p BGR images
+DEFAULT_BUFFER_POOL_BYTES      = 64 * 1024 * 1024
+
+
+cdef class _TJDecompressor:
+    """Owns a turbojpeg decompressor handle. Handles must not be shared across threads."""
+    cdef turbojpeg.tjhandle handle
+
+    def __cinit__(self):
+        self.handle = turbojpeg.tjInitDecompress()
+
+    def __dealloc__(self):
+        if self.handle != NULL:
+            turbojpeg.tjDestroy(self.handle)
+
+
+_thread_local = threading.local()
+
+
+cdef list _supported_scaling_factors():
+    """Returns the (num, denom) scaling factors supported by turbojpeg."""
+    cdef int num_factors = 0
+    cdef turbojpeg.tjscalingfactor *factors = turbojpeg.tjGetScalingFactors(&num_factors)
+    return [(factors[i].num, factors[i].denom) for i in range(num_factors)]
+
+
+cdef tuple _scaling_factor(scale):
+    """Maps a scale, e.g. 0.5 or Fraction(1, 4), to a turbojpeg scaling factor."""
+    cdef Py_ssize_t num, denom
+    fraction = Fraction(scale).limit_denominator(16)
+    for num, denom in _supported_scaling_factors():
+        if num * fraction.denominator == denom * fraction.numerator:
+            return num, denom
+    raise ValueError('Unsupported JPEG scale {}. Supported scales: {}'.format(
+        scale, ', '.join('{}/{}'.format(*f) for f in _supported_scaling_factors())))
+
+
+cdef object _tj_subsampling(AVPixelFormat pixel_format):
+    """Maps planar YUV pixel formats of FFmpeg to turbojpeg subsampling options."""
+    if pixel_format == AV_PIX_FMT_YUV420P or pixel_format == AV_PIX_FMT_YUVJ420P:
+        return turbojpeg.TJSAMP_420
+    if pixel_format == AV_PIX_FMT_YUV422P or pixel_format == AV_PIX_FMT_YUVJ422P:
+        return turbojpeg.TJSAMP_422
+    if pixel_format == AV_PIX_FMT_YUV444P or pixel_format == AV_PIX_FMT_YUVJ444P:
+        return turbojpeg.TJSAMP_444
+    raise ValueError('Unsupported H264 output format {}'.format(pixel_format))
+
+
+cdef tuple _yuv_planes(yuv_buffer, int width, int height, int subsampling):
+    """Splits a planar YUV buffer without row padding into Y, U and V arrays."""
+    cdef int uv_width = width, uv_height = height
+    if subsampling == turbojpeg.TJSAMP_420 or subsampling == turbojpeg.TJSAMP_422:
+        uv_width = (width + 1) // 2
+    if subsampling == turbojpeg.TJSAMP_420:
+        uv_height = (height + 1) // 2
+    y_plane_len = width * height
+    uv_plane_len = uv_width * uv_height
+    buffer_ = np.asarray(yuv_buffer)
+    Y = buffer_[:y_plane_len].reshape(height, width)
+    offset = y_plane_len
+    U = buffer_[offset:offset+uv_plane_len].reshape(uv_height, uv_width)
+    offset += uv_plane_len
+    V = buffer_[offset:offset+uv_plane_len].reshape(uv_height, uv_width)
+    return Y, U, V
+
+
+cdef unsigned char[::1] _output_view(out, int height, int width, int channels):
+    """Validates a caller-provided output buffer and returns a flat view of it."""
+    if channels == 1:
+        shape = (height, width)
+    else:
+        shape = (height, width, channels)
+    array = np.asarray(out)
+    if array.dtype != np.uint8:
+        raise ValueError('Expected output buffer of dtype uint8, got {}'.format(array.dtype))
+    if array.shape != shape and array.shape != (height * width * channels,):
+        raise ValueError('Expected output buffer of shape {}, got {}'.format(shape, array.shape))
+    if not array.flags.c_contiguous or not array.flags.writeable:
+        raise ValueError('Output buffer must be writable and C-contiguous')
+    return array.reshape(-1)
+
+
+cdef _empty_buffer(BufferPool pool, shape):
+    """Returns an uninitialized uint8 array, taken from the pool if there is one."""
+    if pool is None:
+        return np.empty(shape, dtype=np.uint8)
+    return pool.acquire(shape)
+
+
+cdef _empty_image(BufferPool pool, int height, int width, int channels):
+    if channels == 1:
+        return _empty_buffer(pool, (height, width))
+    return _empty_buffer(pool, (height, width, channels))
+
+
+cdef _copy_image(image, out):
+    """Copies an image into a caller-provided output buffer."""
+    channels = image.shape[2] if image.ndim == 3 else 1
+    view = _output_view(out, image.shape[0], image.shape[1], channels)
+    np.copyto(np.asarray(view).reshape(image.shape), image)
+    return out
+
+
+cdef _gray2packed(gray, int pixel_format, out=None, BufferPool pool=None):
+    """Replicates a gray image into the channels of a packed pixel format."""
+    cdef int channels = turbojpeg.tjPixelSize[pixel_format]
+    cdef int height = gray.shape[0], width = gray.shape[1]
+    if out is None:
+        out = _empty_image(pool, height, width, channels)
+    image = np.asarray(_output_view(out, height, width, channels)).reshape(height, width, channels)
+    image[...] = gray[:, :, np.newaxis]
+    if pixel_format == turbojpeg.TJPF_RGBA or pixel_format == turbojpeg.TJPF_BGRA:
+        image[:, :, 3] = 255
+    return out
+
+
+cdef turbojpeg.tjhandle _thread_tj_context():
+    """Returns the turbojpeg decompressor handle of the calling thread."""
+    cdef _TJDecompressor decompressor
+    try:
+        decompressor = _thread_local.tj_decompressor
+    except AttributeError:
+        decompressor = _TJDecompressor()
+        _thread_local.tj_decompressor = decompressor
+    return decompressor.handle
+
+cdef class BufferPool:
+    '''
+    Size-keyed free list of uint8 frame buffers.
+
+    Frames created by a FrameFactory take their YUV and BGR buffers from its pool
+    and give them back when they are collected or their caches are cleared.
+    Buffers that are still referenced elsewhere, e.g. by an image returned from
+    the frame, are never reused. At most max_bytes of idle buffers are kept,
+    0 disables pooling.
+
+    hits and misses count the acquired buffers that were reused or allocated.
+    '''
+
+    def __cinit__(self, Py_ssize_t max_bytes=DEFAULT_BUFFER_POOL_BYTES):
+        if max_bytes < 0:
+            raise ValueError('max_bytes must not be negative')
+        self._free = {}
+        self.max_bytes = max_bytes
+        self.pooled_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    cdef acquire(self, shape):
+        """Returns an uninitialized C-contiguous uint8 array of `shape`."""
+        cdef Py_ssize_t size = int(np.prod(shape))
+        free = self._free.get(size)
+        if free:
+            buffer_ = free.pop()
+            self.pooled_bytes -= size
+            self.hits += 1
+            # reshape in place, the buffer has to stay the owner of its memory
+            buffer_.shape = shape
+            return buffer_
+        self.misses += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    cdef release(self, buffer_):
+        """
+        Takes back an array that owns its memory. The caller must make sure that
+        nothing else references it.
+        """
+        cdef Py_ssize_t size = buffer_.nbytes
+        if self.pooled_bytes + size > self.max_bytes:
+            return
+        self._free.setdefault(size, []).append(buffer_)
+        self.pooled_bytes += size
+
+    def clear(self):
+        """Drops all idle buffers."""
+        self._free.clear()
+        self.pooled_bytes = 0
+
+
 cdef class FrameFactory:
+    '''
+    Creates frames from received video data.
 
-    def __cinit__(self, *args, **kwargs):
-        self.decoder = new H264Decoder(COLOR_FORMAT_YUV422)
+    A FrameFactory holds the decoder state of a single stream and must only be used
+    by one thread at a time. Frames created by it can be converted from any thread;
+    the turbojpeg and FFmpeg calls run without holding the GIL.
+    '''
+
+    def __cinit__(
+        self, *args, h264_color_format=H264_COLOR_FORMAT_YUV422,
+        int h264_thread_count=1, int h264_thread_type=0,
+        Py_ssize_t buffer_pool_bytes=DEFAULT_BUFFER_POOL_BYTES, **kwargs
+    ):
+        '''
+        h264_thread_count - number of H264 decoder threads, 0 picks one per core
+        h264_thread_type - H264_THREAD_FRAME and/or H264_THREAD_SLICE, 0 for default
+        buffer_pool_bytes - memory cap of idle frame buffers in buffer_pool
+        '''
+        if h264_color_format not in (
+            H264_COLOR_FORMAT_YUV420, H264_COLOR_FORMAT_YUV422, H264_COLOR_FORMAT_NATIVE
+        ):
+            raise ValueError('Unsupported H264 color format {}'.format(h264_color_format))
+        self.decoder = new H264Decoder(
+            <color_format_t>h264_color_format, h264_thread_count, h264_thread_type)
+        self.buffer_pool = BufferPool(buffer_pool_bytes)
+        self.gray_only = False
 
     def __init__(self, *args, **kwargs):
         self.tj_context = turbojpeg.tjInitDecompress()
 
-    def create_jpeg_frame(self, buffer_, meta_data):
+    def __dealloc__(self):
+        del self.decoder
+        if self.tj_context != NULL:
+            turbojpeg.tjDestroy(self.tj_context)
+
+    def reset(self):
+        """
+        Drops the H264 decoder state, e.g. before decoding another stream.
+        """
+        self.decoder.flush()
+
+    def create_jpeg_frame(self, buffer_, meta_data, copy=False):
         """
         meta_data[4] - timestamp in microseconds
+
+        The frame references `buffer_` directly. Pass `copy=True` to detach the
+        frame from the memory of `buffer_`, e.g. if it is going to be reused.
         """
         meta_data = list(meta_data)
         meta_data[4] /= 1e6  # Convert timestamp us -> s
         meta_data = tuple(meta_data)
-        cdef JPEGFrame frame = JPEGFrame(*meta_data, zmq_frame=buffer_)
+        cdef JPEGFrame frame = JPEGFrame(*meta_data, zmq_frame=buffer_, copy=copy)
         frame.attach_tj_context(self.tj_context)
+        frame.gray_only = self.gray_only
+        frame._pool = self.buffer_pool
         return frame
 
     def create_h264_frame(self, buffer_, meta_data):
         """
         meta_data[4] - timestamp in microseconds
+
+        Returns the newest frame that the decoder produced or None.
+        Older frames are dropped without conversion.
+        """
+        cdef int64_t pkt_pts = 0 # explicit define required for macos.
+        self._decode_h264_packet(buffer_, meta_data)
+        while self.decoder.get_output_frame_count() > 1:
+            self.decoder.drop_output_frame(pkt_pts)
+        if self.decoder.is_frame_ready():
+            return self._pop_h264_frame(buffer_, meta_data)
+        return None
+
+    def create_h264_frames(self, buffer_, meta_data):
+        """
+        meta_data[4] - timestamp in microseconds
+
+        Decodes the packet and returns an iterator over all frames that the decoder
+        produced, oldest first. A single packet can produce several frames, or none
+        if the decoder delays its output, e.g. with frame threading.
+        """
+        self._decode_h264_packet(buffer_, meta_data)
+        return self._iter_h264_frames(buffer_, meta_data)
+
+    def create_h264_packet(self, buffer_, meta_data):
+        """
+        meta_data[4] - timestamp in microseconds
+
+        Wraps the packet without decoding it, e.g. for recording with H264Writer.
+        """
+        meta_data = list(meta_data)
+        meta_data[4] = round(meta_data[4] * 1e-6, 6)  # Convert timestamp us -> s
+        return H264Packet(*meta_data[:6], h264_buffer=buffer_)
+
+    def skip_h264_packet(self, buffer_, meta_data):
+        """
+        meta_data[4] - timestamp in microseconds
+
+        Decodes a packet whose frames are not going to be used, e.g. while catching
+        up with a backlog. Reference frames are decoded to keep the decoder state
+        intact, non-reference frames are skipped and no output is converted.
         """
-        cdef H264Frame frame = None
-        cdef unsigned char[:] out_buffer
         cdef int64_t pkt_pts = 0 # explicit define required for macos.
+        self.decoder.set_skip_nonref(True)
+        try:
+            self._decode_h264_packet(buffer_, meta_data)
+        finally:
+            self.decoder.set_skip_nonref(False)
+        while self.decoder.is_frame_ready():
+            self.decoder.drop_output_frame(pkt_pts)
+
+    def _iter_h264_frames(self, buffer_, meta_data):
+        while self.decoder.is_frame_ready():
+            yield self._pop_h264_frame(buffer_, meta_data)
+
+    cdef _decode_h264_packet(self, buffer_, meta_data):
+        cdef const unsigned char[::1] in_buffer = buffer_
+        cdef size_t in_size = min(meta_data[5], in_buffer.shape[0])
+        cdef np.uint8_t *in_ptr
         cdef int64_t time_us = int(meta_data[4])
+
+        if in_size == 0:
+            return
+        # libavcodec copies unreferenced packet data, it is never written to
+        in_ptr = <np.uint8_t *>&in_buffer[0]
+        with nogil:
+            self.decoder.set_input_buffer(in_ptr, in_size, time_us)
+
+    cdef H264Frame _pop_h264_frame(self, buffer_, meta_data):
+        cdef H264Frame frame = None
+        cdef unsigned char[::1] out_buffer
+        cdef size_t out_size
+        cdef int out_bytes
+        cdef int64_t pkt_pts = 0 # explicit define required for macos.
         cdef double pupil_ts = 0.0
 
-        out = self.decoder.set_input_buffer(bytearray(buffer_), meta_data[5], time_us)
-        if self.decoder.is_frame_ready():
-            out_size = self.decoder.get_output_bytes()
-            out_buffer = np.empty(out_size, dtype=np.uint8)
-            out_size = self.decoder.get_output_buffer(&out_buffer[0], out_size, pkt_pts)
-            # The observation here is that the output frame comes from the input set right before.
-            # this means that we can use the timestamps from meta_data of the input buffer frame.
-            # to be on the save side we still use the h264 packet pts of the output
-            # print(round(pkt_pts*1e-6,6),meta_data[4] )
-            pupil_ts = round(pkt_pts * 1e-6, 6)  # Convert timestamp us -> s
-            frame = H264Frame(*meta_data[:4], timestamp=pupil_ts, data_len=out_size, yuv_buffer=out_buffer, h264_buffer=buffer_)
-            frame.attach_tj_context(self.tj_context)
+        yuv_subsampling = _tj_subsampling(self.decoder.get_output_format())
+        out_size = self.decoder.get_output_bytes()
+        yuv_buffer = self.buffer_pool.acquire((out_size,))
+        out_buffer = yuv_buffer
+        with nogil:
+            out_bytes = self.decoder.get_output_buffer(&out_buffer[0], out_size, pkt_pts)
+        # The observation here is that the output frame comes from the input set right before.
+        # this means that we can use the timestamps from meta_data of the input buffer frame.
+        # to be on the save side we still use the h264 packet pts of the output
+        # print(round(pkt_pts*1e-6,6),meta_data[4] )
+        pupil_ts = round(pkt_pts * 1e-6, 6)  # Convert timestamp us -> s
+        frame = H264Frame(*meta_data[:4], timestamp=pupil_ts, data_len=out_bytes, yuv_buffer=yuv_buffer, h264_buffer=buffer_, yuv_subsampling=yuv_subsampling)
+        frame._pool = self.buffer_pool
         return frame
 
 
+@cython.no_gc_clear
 cdef class JPEGFrame:
     '''
     The Frame Object holds image data and image metadata.
@@ -107,34 +428,47 @@ cdef class JPEGFrame:
     Frame will use caching to avoid redunant work.
     Usually RGB8,YUYV or GRAY are requested formats.
 
-    WARNING:
-    When capture.get_frame() is called again previos instances of Frame will point to invalid memory.
-    Specifically all image data in the capture transport format.
-    Previously converted formats are still valid.
+    The JPEG data is not copied. The frame keeps a reference to the buffer it was
+    created from (usually a zmq.Frame received with copy=False) instead.
+    Use copy=True to create a frame that owns a detached copy of the data.
+
+    If gray_only is set, only the luminance is decoded for packed outputs.
+    bgr, rgb and rgba then hold the gray image in every color channel.
     '''
 
     def __cinit__(self,*args,**kwargs):
         self._yuv_converted = False
-        self._bgr_converted = False
-        self.tj_context = NULL
+        self._packed_cache = {}
+        self.gray_only = False
 
-    def __init__(self, data_format, width, height, index, timestamp, data_len, reserved, object zmq_frame):
+    def __init__(self, data_format, width, height, index, timestamp, data_len, reserved, object zmq_frame, bint copy=False):
         #if data_format != VIDEO_FRAME_FORMAT_MJPEG:
         #    raise ValueError('%s does not support format %s'%(self.__class__.__name__, hex(data_format)))
+        if copy:
+            zmq_frame = bytes(zmq_frame)
         self._width       = width
         self._height      = height
         self._index       = index
-        self._buffer_len  = data_len
-        self._raw_data    = bytearray(zmq_frame)
+        self._raw_data    = zmq_frame
+        self._jpeg_buffer = zmq_frame
+        self._buffer_len  = min(data_len, self._jpeg_buffer.shape[0])
         self.timestamp    = timestamp
 
-    cdef attach_tj_context(self, turbojpeg.tjhandle ctx):
-        self.tj_context = ctx
+    cdef unsigned char *_jpeg_ptr(self):
+        # turbojpeg does not write to the jpeg buffer but does not declare it const
+        if self._jpeg_buffer.shape[0] == 0:
+            return NULL
+        return <unsigned char *>&self._jpeg_buffer[0]
 
+    cdef attach_tj_context(self, turbojpeg.tjhandle ctx):
         # encode header to check integrety and frame properties
+        # ctx is only used here, conversions use the handle of the converting thread
         cdef int jpegSubsamp, j_width, j_height,result
+        if self._buffer_len == 0:
+            logger.warning('Received empty frame.')
+            return
         result = turbojpeg.tjDecompressHeader2(
-            self.tj_context,self._raw_data, self._buffer_len,
+            ctx, self._jpeg_ptr(), self._buffer_len,
             &j_width, &j_height, &jpegSubsamp)
         if result != -1:
             self._width  = j_width
@@ -143,7 +477,7 @@ cdef class JPEGFrame:
             logger.warning('Received corrupted frame. Could not decompress header.')
 
     def __dealloc__(self):
-        pass
+        self._release_buffers()
 
     property width:
         def __get__(self):
@@ -159,14 +493,16 @@ cdef class JPEGFrame:
 
     property jpeg_buffer:
         def __get__(self):
-            return self._raw_data
+            # read-only view, no copy
+            jpeg_view = np.asarray(self._jpeg_buffer)
+            jpeg_view.flags.writeable = False
+            return jpeg_view
 
     property yuv_buffer:
         def __get__(self):
             if self._yuv_converted is False:
                 self.jpeg2yuv()
-            cdef np.uint8_t[::1] view = <np.uint8_t[:self._yuv_buffer.shape[0]]>&self._yuv_buffer[0]
-            return view
+            return self._yuv_buffer
 
     property yuv420:
         def __get__(self):
@@ -246,43 +582,171 @@ cdef class JPEGFrame:
         def __get__(self):
             # return gray aka luminace plane of YUV image.
             if self._yuv_converted is False:
-                self.jpeg2yuv()
+                return self._packed(turbojpeg.TJPF_GRAY)
             cdef np.ndarray[np.uint8_t, ndim=2] Y
             Y = np.asarray(self._yuv_buffer[:self.width*self.height]).reshape(self.height,self.width)
             return Y
 
     property bgr:
         def __get__(self):
-            if self._bgr_converted is False:
-                if self._yuv_converted is False:
-                    self.jpeg2yuv()
-                self.yuv2bgr()
+            return self._packed(turbojpeg.TJPF_BGR)
+
+    property rgb:
+        def __get__(self):
+            return self._packed(turbojpeg.TJPF_RGB)
 
-            cdef np.ndarray[np.uint8_t, ndim=3] BGR
-            BGR = np.asarray(self._bgr_buffer).reshape(self.height,self.width,3)
-            return BGR
+    property rgba:
+        def __get__(self):
+            return self._packed(turbojpeg.TJPF_RGBA)
 
     #for legacy reasons.
     property img:
         def __get__(self):
             return self.bgr
 
-    cdef yuv2bgr(self):
-        #2.75 ms at 1080p
-        cdef int channels = 3
+    def decode_gray(self, out=None):
+        '''
+        Gray image decoded into `out`, a writable C-contiguous uint8 buffer of
+        shape (height, width) or (height * width,), e.g. a numpy array or a
+        shared memory slot. The frame does not keep a reference to `out`.
+
+        Returns `out`, or the cached gray image if `out` is None.
+        '''
+        if out is None:
+            return self.gray
+        return self._packed_into(turbojpeg.TJPF_GRAY, out)
+
+    def decode_bgr(self, out=None):
+        '''
+        BGR image decoded into `out`, a writable C-contiguous uint8 buffer of
+        shape (height, width, 3) or (height * width * 3,).
+
+        Returns `out`, or the cached BGR image if `out` is None.
+        '''
+        if out is None:
+            return self.bgr
+        return self._packed_into(turbojpeg.TJPF_BGR, out)
+
+    def gray_scaled(self, scale):
+        '''
+        Gray image decoded directly at `scale`, e.g. 1/2 or 1/4.
+        Supported scales are the turbojpeg scaling factors (multiples of 1/8).
+        '''
+        return self._scaled(turbojpeg.TJPF_GRAY, scale)
+
+    def bgr_scaled(self, scale):
+        '''
+        BGR image decoded directly at `scale`, e.g. 1/2 or 1/4.
+        Supported scales are the turbojpeg scaling factors (multiples of 1/8).
+        '''
+        return self._scaled(turbojpeg.TJPF_BGR, scale)
+
+    cdef _packed(self, int pixel_format):
+        key = (pixel_format, 1, 1)
+        try:
+            return self._packed_cache[key]
+        except KeyError:
+            pass
+        if self.gray_only and pixel_format != turbojpeg.TJPF_GRAY:
+            image = _gray2packed(self.gray, pixel_format, None, self._pool)
+        elif self._yuv_converted:
+            # planes are decoded already, only convert colors
+            image = self._yuv2packed(pixel_format)
+        else:
+            # single pass jpeg -> packed pixels, skips the planar YUV intermediate
+            image = self._decompress(pixel_format, 1, 1)
+        self._packed_cache[key] = image
+        return image
+
+    cdef _packed_into(self, int pixel_format, out):
+        cached = self._packed_cache.get((pixel_format, 1, 1))
+        if cached is None and pixel_format == turbojpeg.TJPF_GRAY and self._yuv_converted:
+            cached = self.gray
+        if cached is not None:
+            return _copy_image(cached, out)
+        if self.gray_only and pixel_format != turbojpeg.TJPF_GRAY:
+            return _gray2packed(self.gray, pixel_format, out)
+        if self._yuv_converted:
+            return self._yuv2packed(pixel_format, out)
+        return self._decompress(pixel_format, 1, 1, out)
+
+    cdef _scaled(self, int pixel_format, scale):
+        cdef int num, denom
+        num, denom = _scaling_factor(scale)
+        if num == denom:
+            return self._packed(pixel_format)
+        key = (pixel_format, num, denom)
+        try:
+            return self._packed_cache[key]
+        except KeyError:
+            pass
+        if self.gray_only and pixel_format != turbojpeg.TJPF_GRAY:
+            gray = self._scaled(turbojpeg.TJPF_GRAY, scale)
+            image = _gray2packed(gray, pixel_format, None, self._pool)
+        else:
+            image = self._decompress(pixel_format, num, denom)
+        self._packed_cache[key] = image
+        return image
+
+    cdef _decompress(self, int pixel_format, int num, int denom, out=None):
+        # decompress the jpeg without planar YUV intermediate,
+        # scaled by num/denom (see TJSCALED in turbojpeg.h)
+        # into out or a new array
         cdef int result
-        self._bgr_buffer = np.empty(self.width*self.height*channels, dtype=np.uint8)
-        result = turbojpeg.tjDecodeYUV(
-            self.tj_context, &self._yuv_buffer[0], 4, self.yuv_subsampling,
-            &self._bgr_buffer[0], self.width, 0,
-            self.height, turbojpeg.TJPF_BGR, 0)
+        cdef int width = (self._width * num + denom - 1) // denom
+        cdef int height = (self._height * num + denom - 1) // denom
+        cdef int channels = turbojpeg.tjPixelSize[pixel_format]
+        cdef turbojpeg.tjhandle tj_context = _thread_tj_context()
+        cdef unsigned char *jpeg_ptr = self._jpeg_ptr()
+        cdef long unsigned int jpeg_len = self._buffer_len
+        cdef unsigned char[::1] out_buffer
+        if out is None:
+            out = _empty_image(self._pool, height, width, channels)
+        out_buffer = _output_view(out, height, width, channels)
+        with nogil:
+            result = turbojpeg.tjDecompress2(
+                tj_context, jpeg_ptr, jpeg_len,
+                &out_buffer[0], width, 0, height, pixel_format, 0)
+        if result == -1:
+            logger.error('Turbojpeg decompress: {}'.format(turbojpeg.tjGetErrorStr().decode()))
+        return out
+
+    cdef _yuv2packed(self, int pixel_format, out=None):
+        #2.75 ms at 1080p for BGR
+        cdef int result
+        cdef int width = self._width, height = self._height
+        cdef int channels = turbojpeg.tjPixelSize[pixel_format]
+        cdef int subsampling = self.yuv_subsampling
+        cdef turbojpeg.tjhandle tj_context = _thread_tj_context()
+        # local references keep the buffers alive while the GIL is released
+        cdef unsigned char[:] yuv_buffer = self._yuv_buffer
+        cdef unsigned char[::1] out_buffer
+        if out is None:
+            out = _empty_image(self._pool, height, width, channels)
+        out_buffer = _output_view(out, height, width, channels)
+        with nogil:
+            result = turbojpeg.tjDecodeYUV(
+                tj_context, &yuv_buffer[0], 4, subsampling,
+                &out_buffer[0], width, 0,
+                height, pixel_format, 0)
         if result == -1:
             logger.error('Turbojpeg yuv2bgr: {}'.format(turbojpeg.tjGetErrorStr()))
-        self._bgr_converted = True
+        return out
 
     def clear_caches(self):
-        self._bgr_converted = False
+        self._release_buffers()
+
+    cdef _release_buffers(self):
+        # only buffers without references outside of this frame can be reused
+        buffer_ = self._yuv_buffer
+        self._yuv_buffer = None
         self._yuv_converted = False
+        if self._pool is not None and buffer_ is not None and Py_REFCNT(buffer_) == 1:
+            self._pool.release(buffer_)
+        for key in list(self._packed_cache):
+            buffer_ = self._packed_cache.pop(key)
+            if self._pool is not None and Py_REFCNT(buffer_) == 1:
+                self._pool.release(buffer_)
 
     cdef jpeg2yuv(self):
         # 7.55 ms on 1080p
@@ -291,9 +755,14 @@ cdef class JPEGFrame:
         cdef int result
         cdef long unsigned int buf_size
         cdef char* error_c
-        result = turbojpeg.tjDecompressHeader2(
-            self.tj_context, self._raw_data, self._buffer_len,
-            &j_width, &j_height, &jpegSubsamp)
+        cdef turbojpeg.tjhandle tj_context = _thread_tj_context()
+        cdef unsigned char *jpeg_ptr = self._jpeg_ptr()
+        cdef long unsigned int jpeg_len = self._buffer_len
+        cdef unsigned char[:] yuv_buffer
+        with nogil:
+            result = turbojpeg.tjDecompressHeader2(
+                tj_context, jpeg_ptr, jpeg_len,
+                &j_width, &j_height, &jpegSubsamp)
 
         if result == -1:
             logger.error('Turbojpeg could not read jpeg header: {0}'.format(turbojpeg.tjGetErrorStr().decode()))
@@ -301,11 +770,14 @@ cdef class JPEGFrame:
             j_width, j_height, jpegSubsamp = self.width, self.height, turbojpeg.TJSAMP_422
 
         buf_size = turbojpeg.tjBufSizeYUV(j_height, j_width, jpegSubsamp)
-        self._yuv_buffer = np.empty(buf_size, dtype=np.uint8)
+        yuv_array = _empty_buffer(self._pool, (buf_size,))
+        yuv_buffer = yuv_array
         if result != -1:
-            result = turbojpeg.tjDecompressToYUV(
-                self.tj_context, self._raw_data, self._buffer_len,
-                &self._yuv_buffer[0], 0)
+            with nogil:
+                result = turbojpeg.tjDecompressToYUV(
+                    tj_context, jpeg_ptr, jpeg_len,
+                    &yuv_buffer[0], 0)
+        self._yuv_buffer = yuv_array
         if result == -1:
             error_c = turbojpeg.tjGetErrorStr()
             if error_c != b"No error":
@@ -314,26 +786,28 @@ cdef class JPEGFrame:
         self._yuv_converted = True
 
 
+@cython.no_gc_clear
 cdef class H264Frame:
     def __cinit__(self,*args,**kwargs):
         self._bgr_converted = False
-        self.tj_context = NULL
 
-    def __init__(self, data_format, width, height, index, timestamp, data_len, yuv_buffer, h264_buffer):
+    def __init__(self, data_format, width, height, index, timestamp, data_len, yuv_buffer, h264_buffer, yuv_subsampling=turbojpeg.TJSAMP_422):
+        self.yuv_subsampling = yuv_subsampling
         self._width       = width
         self._height      = height
         self._index       = index
         self._buffer_len  = data_len
         self._yuv_buffer  = yuv_buffer
-        self._h264_buffer = np.fromstring(h264_buffer, dtype=np.uint8)
+        h264_view = np.frombuffer(h264_buffer, dtype=np.uint8)
+        h264_view.flags.writeable = False
+        self._h264_buffer = h264_view
         self.timestamp    = timestamp
 
-    cdef attach_tj_context(self, turbojpeg.tjhandle ctx):
-        self.tj_context = ctx
-
     property is_iframe:
         def __get__(self):
-            return (0 == get_vop_type_annexb(&self._h264_buffer[0], len(self._h264_buffer)))
+            if self._h264_buffer.shape[0] == 0:
+                return False
+            return annexb_is_idr(&self._h264_buffer[0], self._h264_buffer.shape[0])
 
     property width:
         def __get__(self):
@@ -359,6 +833,40 @@ cdef class H264Frame:
         def __get__(self):
             return self._h264_buffer
 
+    property yuv420:
+        def __get__(self):
+            '''
+            planar YUV420 returned in 3 numpy arrays:
+            420 subsampling:
+                Y(height,width) U(height/2,width/2), V(height/2,width/2)
+            '''
+            Y, U, V = _yuv_planes(self._yuv_buffer, self._width, self._height, self.yuv_subsampling)
+            if self.yuv_subsampling == turbojpeg.TJSAMP_422:
+                #hack solution to go from YUV422 to YUV420
+                U = U[::2,:]
+                V = V[::2,:]
+            elif self.yuv_subsampling == turbojpeg.TJSAMP_444:
+                #hack solution to go from YUV444 to YUV420
+                U = U[::2,::2]
+                V = V[::2,::2]
+            return Y,U,V
+
+    property yuv422:
+        def __get__(self):
+            '''
+            planar YUV422 returned in 3 numpy arrays:
+            422 subsampling:
+                Y(height,width) U(height,width/2), V(height,width/2)
+            '''
+            if self.yuv_subsampling == turbojpeg.TJSAMP_420:
+                raise Exception("can not convert from YUV420 to YUV422")
+            Y, U, V = _yuv_planes(self._yuv_buffer, self._width, self._height, self.yuv_subsampling)
+            if self.yuv_subsampling == turbojpeg.TJSAMP_444:
+                #hack solution to go from YUV444 to YUV422
+                U = U[:,::2]
+                V = V[:,::2]
+            return Y,U,V
+
     property gray:
         def __get__(self):
             # return gray aka luminace plane of YUV image.
@@ -369,31 +877,121 @@ cdef class H264Frame:
     property bgr:
         def __get__(self):
             if self._bgr_converted is False:
-                self.yuv2bgr()
-            cdef np.ndarray[np.uint8_t, ndim=3] BGR
-            BGR = np.asarray(self._bgr_buffer).reshape(self.height,self.width,3)
-            return BGR
+                image = _empty_image(self._pool, self._height, self._width, 3)
+                self.yuv2bgr(image.reshape(-1))
+                self._bgr_buffer = image
+                self._bgr_converted = True
+            return self._bgr_buffer
 
     #for legacy reasons.
     property img:
         def __get__(self):
             return self.bgr
 
-    cdef yuv2bgr(self):
+    def decode_gray(self, out=None):
+        '''
+        Luminance plane copied into `out`, a writable C-contiguous uint8 buffer
+        of shape (height, width) or (height * width,).
+
+        Returns `out`, or a view of the luminance plane if `out` is None.
+        '''
+        if out is None:
+            return self.gray
+        return _copy_image(self.gray, out)
+
+    def decode_bgr(self, out=None):
+        '''
+        BGR image decoded into `out`, a writable C-contiguous uint8 buffer of
+        shape (height, width, 3) or (height * width * 3,), e.g. a numpy array
+        or a shared memory slot. The frame does not keep a reference to `out`.
+
+        Returns `out`, or the cached BGR image if `out` is None.
+        '''
+        if out is None:
+            return self.bgr
+        if self._bgr_converted:
+            return _copy_image(self.bgr, out)
+        self.yuv2bgr(_output_view(out, self._height, self._width, 3))
+        return out
+
+    cdef yuv2bgr(self, unsigned char[::1] bgr_buffer):
         #2.75 ms at 1080p
-        cdef int channels = 3
         cdef int result
-        self._bgr_buffer = np.empty(self.width*self.height*channels, dtype=np.uint8)
-        result = turbojpeg.tjDecodeYUV(
-            self.tj_context, &self._yuv_buffer[0], 4, turbojpeg.TJSAMP_422,
-            &self._bgr_buffer[0], self.width, 0,
-            self.height, turbojpeg.TJPF_BGR, 0)
+        cdef int width = self._width, height = self._height
+        cdef int subsampling = self.yuv_subsampling
+        cdef turbojpeg.tjhandle tj_context = _thread_tj_context()
+        # local references keep the buffers alive while the GIL is released
+        cdef unsigned char[:] yuv_buffer = self._yuv_buffer
+        with nogil:
+            # the decoder output has no row padding
+            result = turbojpeg.tjDecodeYUV(
+                tj_context, &yuv_buffer[0], 1, subsampling,
+                &bgr_buffer[0], width, 0,
+                height, turbojpeg.TJPF_BGR, 0)
         if result == -1:
             logger.error('Turbojpeg yuv2bgr: {}'.format(turbojpeg.tjGetErrorStr()))
-        self._bgr_converted = True
 
     def clear_caches(self):
+        self._release_bgr_buffer()
+
+    def __dealloc__(self):
+        self._release_bgr_buffer()
+        buffer_ = self._yuv_buffer
+        self._yuv_buffer = None
+        if self._pool is not None and buffer_ is not None and Py_REFCNT(buffer_) == 1:
+            self._pool.release(buffer_)
+
+    cdef _release_bgr_buffer(self):
+        # only buffers without references outside of this frame can be reused
+        buffer_ = self._bgr_buffer
+        self._bgr_buffer = None
         self._bgr_converted = False
+        if self._pool is not None and buffer_ is not None and Py_REFCNT(buffer_) == 1:
+            self._pool.release(buffer_)
+
+
+cdef class H264Packet:
+    '''
+    Compressed-only H264 frame for consumers that never look at pixels.
+
+    Size and timestamp come from the NDSI header, is_iframe from the NAL units.
+    The packet is a read-only view of the received buffer.
+    '''
+
+    def __init__(self, data_format, width, height, index, timestamp, data_len, h264_buffer):
+        self._width       = width
+        self._height      = height
+        self._index       = index
+        h264_view = np.frombuffer(h264_buffer, dtype=np.uint8)[:data_len]
+        h264_view.flags.writeable = False
+        self._h264_buffer = h264_view
+        self.timestamp    = timestamp
+
+    property is_iframe:
+        def __get__(self):
+            if self._h264_buffer.shape[0] == 0:
+                return False
+            return annexb_is_idr(&self._h264_buffer[0], self._h264_buffer.shape[0])
+
+    property width:
+        def __get__(self):
+            return self._width
+
+    property height:
+        def __get__(self):
+            return self._height
+
+    property size:
+        def __get__(self):
+            return (self.width, self.height)
+
+    property index:
+        def __get__(self):
+            return self._index
+
+    property h264_buffer:
+        def __get__(self):
+            return self._h264_buffer
 
 
 cdef inline int interval_to_fps(int interval):
@@ -0,0 +1,294 @@
+"""
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+"""
+
+import concurrent.futures
+import logging
+import queue
+import socket
+import threading
+import traceback as tb
+import typing
+
+import zmq
+
+from ndsi import StreamError
+from ndsi.formatter import DataMessage
+from ndsi.sensor import NotDataSubSupportedError, Sensor
+
+logger = logging.getLogger(__name__)
+
+# Messages received per task, before a busy sensor goes back into the pool's queue
+MAX_MESSAGES_PER_TASK = 100
+
+
+SensorGroupCallback = typing.Callable[[Sensor, typing.Any], None]
+
+
+class SensorGroup:
+    """
+    Receives and decodes the data of several sensors on a pool of worker threads.
+
+    A dispatcher thread polls the notify and data sockets of all sensors and hands
+    sensors with pending messages to the pool. Every sensor has at most one task in
+    flight, so its values are delivered in order, while different sensors are
+    processed in parallel. A task receives up to `MAX_MESSAGES_PER_TASK` messages,
+    sensors with more data are queued again. The values are passed to `callbacks` as
+    `callback(sensor, value)` on the worker threads. Without callbacks, they are
+    put into a merged queue that is read with `get()`; if `queue_size` is
+    reached, the oldest values are dropped.
+
+    While the group is running, its sensors must not be read by other threads,
+    e.g. with `fetch_data()` or `VideoSensor.start_background_decoding()`. The
+    sensors stay linked when the group is stopped.
+    """
+
+    def __init__(
+        self,
+        sensors: typing.Iterable[Sensor] = (),
+        callbacks: typing.Iterable[SensorGroupCallback] = (),
+        max_workers: typing.Optional[int] = None,
+        queue_size: int = 0,
+    ):
+        self.callbacks = list(callbacks)
+        self.max_workers = max_workers
+        self.dropped_values = 0
+        self._values = queue.Queue(maxsize=queue_size)
+        self._put_lock = threading.Lock()
+        self._sensors: typing.List[Sensor] = []
+        self._commands = queue.SimpleQueue()
+        self._finished = queue.SimpleQueue()
+        self._stopping = False
+        self._executor = None
+        self._dispatch_thread = None
+        self._wake_recv = None
+        self._wake_send = None
+        self._poller = None
+        self._idle = []
+        self._in_flight = set()
+        self._removing = {}
+        for sensor in sensors:
+            self.add(sensor)
+
+    @property
+    def sensors(self) -> typing.List[Sensor]:
+        return list(self._sensors)
+
+    @property
+    def running(self) -> bool:
+        return self._dispatch_thread is not None
+
+    def add(self, sensor: Sensor):
+        if not sensor.supports_data_subscription:
+            raise NotDataSubSupportedError()
+        if sensor in self._sensors:
+            return
+        self._sensors.append(sensor)
+        if self.running:
+            self._commands.put((sensor, True, None))
+            self._wake()
+
+    def remove(self, sensor: Sensor):
+        """
+        Removes the sensor from the group. Waits for the sensor's task in flight,
+        i.e. must not be called from a callback.
+        """
+        if sensor not in self._sensors:
+            return
+        self._sensors.remove(sensor)
+        if self.running:
+            removed = threading.Event()
+            self._commands.put((sensor, False, removed))
+            self._wake()
+            removed.wait()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="ndsi sensor group"
+        )
+        self._dispatch_thread = threading.Thread(
+            target=self._dispatch_loop,
+            args=(list(self._sensors),),
+            name="ndsi sensor group dispatcher",
+            daemon=True,
+        )
+        self._dispatch_thread.start()
+
+    def stop(self):
+        """Stops the group after the tasks in flight have finished."""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wake()
+        self._dispatch_thread.join()
+        self._dispatch_thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        # release callers of remove() that raced with stop()
+        while True:
+            try:
+                _, _, removed = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if removed is not None:
+                removed.set()
+        self._wake_recv.close()
+        self._wake_send.close()
+        self._wake_recv = self._wake_send = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get(self, timeout=None) -> typing.Tuple[Sensor, typing.Any]:
+        """
+        Returns the next `(sensor, value)` of the merged queue, waiting up to
+        `timeout` ms for one.
+        """
+        try:
+            # timeout is given in milliseconds, like for zmq.Socket.poll
+            return self._values.get(timeout=None if timeout is None else timeout / 1000)
+        except queue.Empty:
+            raise StreamError("Operation timed out.")
+
+    def _dispatch_loop(self, sensors):
+        # dispatcher state, only accessed by the dispatcher thread
+        self._poller = zmq.Poller()
+        self._poller.register(self._wake_recv, zmq.POLLIN)
+        self._idle = []
+        self._in_flight = set()
+        self._removing = {}
+        for sensor in sensors:
+            self._watch(sensor)
+
+        while True:
+            ready = dict(self._poller.poll())
+            if self._wake_recv in ready:
+                self._drain_wake()
+            self._handle_finished_tasks()
+            self._handle_commands()
+            if self._stopping:
+                for sensor in list(self._idle):
+                    self._unwatch(sensor)
+                if not self._in_flight:
+                    return
+                continue
+            self._submit_ready_sensors(ready)
+
+    def _watch(self, sensor: Sensor):
+        self._poller.register(sensor.notify_sub, zmq.POLLIN)
+        self._poller.register(sensor.data_sub, zmq.POLLIN)
+        self._idle.append(sensor)
+
+    def _unwatch(self, sensor: Sensor):
+        self._poller.unregister(sensor.notify_sub)
+        self._poller.unregister(sensor.data_sub)
+        self._idle.remove(sensor)
+
+    def _handle_finished_tasks(self):
+        while True:
+            try:
+                sensor, has_data = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            if sensor in self._removing:
+                self._in_flight.discard(sensor)
+                self._removing.pop(sensor).set()
+            elif has_data and not self._stopping:
+                # buffered messages of the backpressure policies are not signalled
+                # by the sockets, queue the sensor again right away
+                self._executor.submit(self._process, sensor)
+            else:
+                self._in_flight.discard(sensor)
+                self._watch(sensor)
+
+    def _handle_commands(self):
+        while True:
+            try:
+                sensor, add, removed = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if add:
+                if sensor not in self._idle and sensor not in self._in_flight:
+                    self._watch(sensor)
+            elif sensor in self._in_flight:
+                self._removing[sensor] = removed
+            else:
+                if sensor in self._idle:
+                    self._unwatch(sensor)
+                removed.set()
+
+    def _submit_ready_sensors(self, ready):
+        for sensor in list(self._idle):
+            if sensor.notify_sub in ready or sensor.data_sub in ready:
+                self._unwatch(sensor)
+                self._in_flight.add(sensor)
+                self._executor.submit(self._process, sensor)
+
+    def _process(self, sensor: Sensor):
+        has_data = False
+        try:
+            while sensor.has_notifications:
+                sensor.handle_notification()
+            for _ in range(MAX_MESSAGES_PER_TASK):
+                if self._stopping or not sensor.has_data:
+                    break
+                data_msg = DataMessage(*sensor.get_data(copy=False))
+                for value in sensor.formatter.decode_msg(data_msg=data_msg):
+                    if value is not None:
+                        self._deliver(sensor, value)
+            has_data = bool(sensor.has_data)
+        except Exception:
+            logger.debug(tb.format_exc())
+        finally:
+            self._finished.put((sensor, has_data))
+            self._wake()
+
+    def _deliver(self, sensor: Sensor, value):
+        if self.callbacks:
+            for callback in self.callbacks:
+                try:
+                    callback(sensor, value)
+                except Exception:
+                    # keep delivering the remaining values and callbacks
+                    logger.exception(f"Error in callback {callback} for {sensor}")
+            return
+        with self._put_lock:
+            try:
+                self._values.put_nowait((sensor, value))
+            except queue.Full:
+                # drop the oldest value
+                try:
+                    self._values.get_nowait()
+                except queue.Empty:
+                    pass
+                self.dropped_values += 1
+                self._values.put_nowait((sensor, value))
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b"\0")
+        except BlockingIOError:
+            pass  # the dispatcher has not read the previous wake-ups yet
+
+    def _drain_wake(self):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
@@ -14,26 +14,43 @@ from libcpp.string cimport string
 
 
 cdef extern from "<libavcodec/avcodec.h>":
+    enum:
+        FF_THREAD_FRAME
+        FF_THREAD_SLICE
+
     struct AVCodec:
         pass
 
     struct AVCodecContext:
         pass
 
+cdef extern from "<libavutil/pixfmt.h>":
+    cdef enum AVPixelFormat:
+        AV_PIX_FMT_YUV420P
+        AV_PIX_FMT_YUVJ420P
+        AV_PIX_FMT_YUV422P
+        AV_PIX_FMT_YUVJ422P
+        AV_PIX_FMT_YUV444P
+        AV_PIX_FMT_YUVJ444P
+
 cdef extern from "<libavformat/avformat.h>":
     struct AVFormatContext:
         pass
 
 
-cdef extern from "h264/h264_decoder.h" namespace "serenegiant::media":
-    cdef enum color_format_t:
+cdef extern from "h264/h264_decoder.h" namespace "serenegiant::media" nogil:
+    ctypedef enum color_format_t:
         COLOR_FORMAT_YUV420 = 0
         COLOR_FORMAT_YUV422
         COLOR_FORMAT_RGB565LE
         COLOR_FORMAT_BGR32
+        COLOR_FORMAT_NATIVE
 
     cdef cppclass H264Decoder:
         H264Decoder(const color_format_t &color_format)
+        H264Decoder(const color_format_t &color_format,
+                    const int &thread_count,
+                    const int &thread_type)
         H264Decoder()
 
         AVCodecContext *get_context()
@@ -42,6 +59,7 @@ cdef extern from "h264/h264_decoder.h" namespace "serenegiant::media":
         const int width()
         const int height()
         const int get_output_bytes()
+        const AVPixelFormat get_output_format()
 
         int set_input_buffer(np.uint8_t *nal_units,
                              const size_t &bytes,
@@ -51,8 +69,13 @@ cdef extern from "h264/h264_decoder.h" namespace "serenegiant::media":
                               const size_t &capacity,
                               np.int64_t &result_pts)
 
+        const size_t get_output_frame_count()
+        int drop_output_frame(np.int64_t &result_pts)
+        void set_skip_nonref(const bint &skip)
+        void flush()
+
 
-cdef extern from "h264/h264_utils.h" namespace "serenegiant::media":
+cdef extern from "h264/h264_utils.h" namespace "serenegiant::media" nogil:
     int get_vop_type_annexb(const np.uint8_t *data, const size_t &size)
 
 
@@ -28,12 +28,13 @@ namespace serenegiant {
 namespace media {
 
 /*public*/
-H264Decoder::H264Decoder(const color_format_t &_color_format)
+H264Decoder::H264Decoder(const color_format_t &_color_format,
+	const int &thread_count, const int &thread_type)
 :	color_format(AV_PIX_FMT_YUV420P),
 	codec_context(NULL),
 	src(NULL), dst(NULL),
 	sws_context(NULL),
-	frame_ready(false)
+	native_output(false)
 {
 	ENTER();
 
@@ -50,6 +51,11 @@ H264Decoder::H264Decoder(const color_format_t &_color_format)
 	case COLOR_FORMAT_BGR32:
 		color_format = AV_PIX_FMT_BGR32;
 		break;
+	case COLOR_FORMAT_NATIVE:
+		// fallback for codec formats that can not be passed through
+		color_format = AV_PIX_FMT_YUV420P;
+		native_output = true;
+		break;
 	default:
 		color_format = AV_PIX_FMT_YUV420P;
 		break;
@@ -60,7 +66,15 @@ H264Decoder::H264Decoder(const color_format_t &_color_format)
 		codec_context = avcodec_alloc_context3(codec);
 		if (LIKELY(codec_context)) {
 			codec_context->pix_fmt = color_format;
-			codec_context->flags2 |= AV_CODEC_FLAG2_CHUNKS;
+			codec_context->thread_count = thread_count;
+			if (thread_type) {
+				codec_context->thread_type = thread_type;
+			}
+			// libavcodec silently disables frame threading for chunked input,
+			// so frame threading requires complete access units per packet
+			if (!(thread_type & FF_THREAD_FRAME)) {
+				codec_context->flags2 |= AV_CODEC_FLAG2_CHUNKS;
+			}
 			if (codec->capabilities & AV_CODEC_CAP_TRUNCATED) {
 				codec_context->flags |= AV_CODEC_FLAG_TRUNCATED;
 			}
@@ -90,6 +104,7 @@ H264Decoder::~H264Decoder() {
 
 	ENTER();
 
+	clear_output_frames();
 	if (codec_context) {
 		avcodec_close(codec_context);
 		av_free(codec_context);
@@ -107,6 +122,30 @@ H264Decoder::~H264Decoder() {
 	EXIT();
 }
 
+/**
+ * pixel format of the output buffer
+ * for COLOR_FORMAT_NATIVE this is the format of the decoded frames if it is
+ * planar 8 bit YUV 4:2:0, 4:2:2 or 4:4:4
+ */
+/*public*/
+const enum AVPixelFormat H264Decoder::get_output_format() {
+	if (native_output && codec_context) {
+		const enum AVPixelFormat pix_fmt = input_format();
+		switch (pix_fmt) {
+		case AV_PIX_FMT_YUV420P:
+		case AV_PIX_FMT_YUVJ420P:
+		case AV_PIX_FMT_YUV422P:
+		case AV_PIX_FMT_YUVJ422P:
+		case AV_PIX_FMT_YUV444P:
+		case AV_PIX_FMT_YUVJ444P:
+			return pix_fmt;
+		default:
+			break;
+		}
+	}
+	return color_format;
+}
+
 /*public*/
 int H264Decoder::set_input_buffer(uint8_t *nal_units, const size_t &bytes, const int64_t &presentation_time_us) {
 
@@ -130,11 +169,10 @@ int H264Decoder::set_input_buffer(uint8_t *nal_units, const size_t &bytes, const
 			result = avcodec_receive_frame(codec_context, src);
 			if (!result) {
 				LOGD("got frame");
-				frame_ready = true;
-				// FIXME avcodec_send_packet may generate multiple frames.
-				// But current implementation handle only one...will lost some of them or get stuck.
-				// If you need all frames, get them and put them into queue and handle them on other thread.
-				break;
+				// avcodec_send_packet may generate multiple frames, queue all of them
+				AVFrame *frame = av_frame_alloc();
+				av_frame_move_ref(frame, src);
+				output_frames.push_back(frame);
 			} else if ((result < 0) && (result != AVERROR(EAGAIN)) && (result != AVERROR_EOF)) {
 				LOGE("avcodec_receive_frame returned error %d:%s", result, av_error(result).c_str());
 			} else {
@@ -176,7 +214,7 @@ ret:
 	if (result >= 0) {
 		if (frame_finished) {
 			LOGD("got frame");
-			frame_ready = true;
+			output_frames.push_back(av_frame_clone(src));
 		}
 		result = 0;
 	}
@@ -192,48 +230,47 @@ int H264Decoder::get_output_buffer(uint8_t *result_buf, const size_t &capacity,
 	if (UNLIKELY(!is_initialized())) RETURN(-1, int);
 
 	result_pts = AV_NOPTS_VALUE;
+	if (UNLIKELY(output_frames.empty())) {
+		LOGE("no frame ready");
+		RETURN(-1, int);
+	}
+	AVFrame *src = output_frames.front();
 	size_t result = get_output_bytes();
 
 	if (LIKELY(capacity >= result)) {
 		const int width = this->width();
 		const int height = this->height();
+		const enum AVPixelFormat src_format = (enum AVPixelFormat)src->format;
+		const enum AVPixelFormat output_format = get_output_format();
 
-		LOGD("Wanted format: %s", av_pix_fmt_desc_get(color_format)->name);
-		LOGD("Given format: %s", av_pix_fmt_desc_get(codec_context->pix_fmt)->name);
+		LOGD("Wanted format: %s", av_pix_fmt_desc_get(output_format)->name);
+		LOGD("Given format: %s", av_pix_fmt_desc_get(src_format)->name);
 
-		if (color_format == codec_context->pix_fmt) {
+		if (output_format == src_format) {
 			LOGD("No conversion needed. Copy buffer.");
 //			memcpy(result_buf, src->data[0], result);	// simple copy does not work well
 #if USE_NEW_AVCODEC_API
 			av_image_copy_to_buffer(result_buf,
-				(int)capacity, (const uint8_t * const *)src->data, src->linesize, color_format, width, height, 1);
+				(int)capacity, (const uint8_t * const *)src->data, src->linesize, output_format, width, height, 1);
 #else
-			avpicture_layout((const AVPicture *)src, color_format, width, height, result_buf, (int)capacity);
+			avpicture_layout((const AVPicture *)src, output_format, width, height, result_buf, (int)capacity);
 #endif
 		} else {
 			LOGD("Conversion needed.");
-			sws_context = sws_getCachedContext(sws_context, width, height, codec_context->pix_fmt,
-			                                   width, height, color_format, SWS_FAST_BILINEAR, NULL, NULL, NULL);
+			sws_context = sws_getCachedContext(sws_context, width, height, src_format,
+			                                   width, height, output_format, SWS_FAST_BILINEAR, NULL, NULL, NULL);
 
 #if USE_NEW_AVCODEC_API
 			av_image_fill_arrays(dst->data, dst->linesize,
-				result_buf, color_format, width, height, 1);
+				result_buf, output_format, width, height, 1);
 #else
-			avpicture_fill((AVPicture *)dst, result_buf, color_format, width, height);
+			avpicture_fill((AVPicture *)dst, result_buf, output_format, width, height);
 #endif
 			sws_scale(sws_context, src->data, src->linesize, 0, height,
 				dst->data, dst->linesize);
 		}
-		frame_ready = false;
-#if USE_NEW_AVCODEC_API
-		result_pts = src->pts; // this is always AV_NOPTS_VALUE
-#else
-		result_pts = src->pkt_pts;
-#endif
-		LOGD("%dx%d,pts=%ld", src->width, src->height, result_pts);
-		if (UNLIKELY(result_pts == AV_NOPTS_VALUE)) {
-			LOGD("No PTS");
-		}
+		LOGD("%dx%d", src->width, src->height);
+		drop_output_frame(result_pts);
 	} else {
 		LOGE("capacity is smaller than required");
 		result = -1;
@@ -242,5 +279,66 @@ int H264Decoder::get_output_buffer(uint8_t *result_buf, const size_t &capacity,
 	RETURN(result, int);
 }
 
+/**
+ * remove the oldest decoded frame without copying/converting it
+ */
+/*public*/
+int H264Decoder::drop_output_frame(int64_t &result_pts) {
+
+	ENTER();
+
+	result_pts = AV_NOPTS_VALUE;
+	if (UNLIKELY(output_frames.empty())) RETURN(-1, int);
+
+	AVFrame *frame = output_frames.front();
+	output_frames.pop_front();
+#if USE_NEW_AVCODEC_API
+	result_pts = frame->pts; // this is always AV_NOPTS_VALUE
+#else
+	result_pts = frame->pkt_pts;
+#endif
+	if (UNLIKELY(result_pts == AV_NOPTS_VALUE)) {
+		LOGD("No PTS");
+	}
+	av_frame_free(&frame);
+
+	RETURN(0, int);
+}
+
+/**
+ * let the codec skip decoding of frames that are not used as reference,
+ * e.g. while catching up with a backlog of packets
+ */
+/*public*/
+void H264Decoder::set_skip_nonref(const bool &skip) {
+	if (LIKELY(is_initialized())) {
+		codec_context->skip_frame = skip ? AVDISCARD_NONREF : AVDISCARD_DEFAULT;
+	}
+}
+
+/*private*/
+void H264Decoder::clear_output_frames() {
+	for (AVFrame *frame : output_frames) {
+		av_frame_free(&frame);
+	}
+	output_frames.clear();
+}
+
+/**
+ * drop all buffered packets/frames so that the decoder can be reused for another stream
+ */
+/*public*/
+void H264Decoder::flush() {
+
+	ENTER();
+
+	if (LIKELY(is_initialized())) {
+		avcodec_flush_buffers(codec_context);
+	}
+	clear_output_frames();
+
+	EXIT();
+}
+
 }	// namespace media
 }	// namespace serenegiant
@@ -14,6 +14,7 @@
 #include <stdlib.h>
 #include <inttypes.h>
 #include <stdarg.h>
+#include <deque>
 
 extern "C" {
 	#include <libavformat/avformat.h>
@@ -32,6 +33,7 @@ typedef enum COLOR_FORMAT {
 	COLOR_FORMAT_YUV422,
 	COLOR_FORMAT_RGB565LE,
 	COLOR_FORMAT_BGR32,
+	COLOR_FORMAT_NATIVE,	// planar YUV as produced by the codec, no conversion
 } color_format_t;
 
 class H264Decoder {
@@ -41,26 +43,49 @@ private:
 	struct AVFrame *src;
 	struct AVFrame *dst;
 	struct SwsContext *sws_context;
-	volatile bool frame_ready;
+	bool native_output;
+	// decoded frames that were not fetched by get_output_buffer yet, oldest first
+	std::deque<AVFrame *> output_frames;
+	void clear_output_frames();
+	inline const enum AVPixelFormat input_format() const {
+		return output_frames.empty() ? codec_context->pix_fmt : (enum AVPixelFormat)output_frames.front()->format;
+	};
 protected:
 public:
-	H264Decoder(const color_format_t &color_format = COLOR_FORMAT_YUV422);
+	/**
+	 * @param thread_count number of decoder threads, 0: automatic
+	 * @param thread_type FF_THREAD_FRAME and/or FF_THREAD_SLICE, 0: codec default
+	 */
+	H264Decoder(const color_format_t &color_format = COLOR_FORMAT_YUV422,
+		const int &thread_count = 1, const int &thread_type = 0);
 	virtual ~H264Decoder();
 
 	inline struct AVCodecContext *get_context() { return codec_context; };
 	inline const bool is_initialized() const { return codec_context != NULL; };
-	inline const bool is_frame_ready() const { return frame_ready; };
-	inline const int width() { return codec_context ? codec_context->width : 0; };
-	inline const int height() { return codec_context ? codec_context->height : 0; };
+	inline const bool is_frame_ready() const { return !output_frames.empty(); };
+	inline const size_t get_output_frame_count() const { return output_frames.size(); };
+	// size of the next output frame
+	inline const int width() {
+		if (!output_frames.empty()) return output_frames.front()->width;
+		return codec_context ? codec_context->width : 0;
+	};
+	inline const int height() {
+		if (!output_frames.empty()) return output_frames.front()->height;
+		return codec_context ? codec_context->height : 0;
+	};
+	const enum AVPixelFormat get_output_format();
 	inline const size_t get_output_bytes() {
 #if USE_NEW_AVCODEC_API
-		return av_image_get_buffer_size(color_format, width(), height(), 1);
+		return av_image_get_buffer_size(get_output_format(), width(), height(), 1);
 #else
-		return avpicture_get_size(color_format, width(), height());
+		return avpicture_get_size(get_output_format(), width(), height());
 #endif
 	};
 	int set_input_buffer(uint8_t *nal_units, const size_t &bytes, const int64_t &presentation_time_us);
 	int get_output_buffer(uint8_t *buf, const size_t &capacity, int64_t &result_pts);
+	int drop_output_frame(int64_t &result_pts);
+	void set_skip_nonref(const bool &skip);
+	void flush();
 };
 
 }	// namespace media
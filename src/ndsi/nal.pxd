@@ -0,0 +1,22 @@
+# cython: language_level=3
+'''
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+'''
+
+cdef enum:
+    NAL_UNIT_SLICE = 1
+    NAL_UNIT_IDR = 5
+    NAL_UNIT_SEI = 6
+    NAL_UNIT_SPS = 7
+    NAL_UNIT_PPS = 8
+    NAL_UNIT_AUD = 9
+
+cdef Py_ssize_t find_nal_start(const unsigned char *data, Py_ssize_t start, Py_ssize_t size) noexcept nogil
+cdef bint annexb_is_keyframe(const unsigned char *data, Py_ssize_t size) noexcept nogil
+cdef bint annexb_is_idr(const unsigned char *data, Py_ssize_t size) noexcept nogil
@@ -0,0 +1,315 @@
+# cython: language_level=3
+'''
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+'''
+
+from collections import namedtuple
+
+NALUnit = namedtuple("NALUnit", ["offset", "type", "size"])
+NALUnit.__doc__ = '''
+Location of a NAL unit inside an Annex-B buffer.
+
+offset points at the NAL header byte (behind the start code), size excludes
+the start code and trailing zero bytes.
+'''
+
+SPSInfo = namedtuple(
+    "SPSInfo", ["profile_idc", "level_idc", "chroma_format_idc", "width", "height"]
+)
+
+# profiles that carry chroma format and bit depth in the SPS
+_HIGH_PROFILES = frozenset((100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135))
+
+
+cdef struct BitReader:
+    const unsigned char *data
+    Py_ssize_t size
+    Py_ssize_t pos
+    int bit
+    int zeros
+    bint overrun
+
+
+cdef inline void _reader_init(BitReader *r, const unsigned char *data, Py_ssize_t size) noexcept nogil:
+    r.data = data
+    r.size = size
+    r.pos = 0
+    r.bit = 0
+    r.zeros = 0
+    r.overrun = False
+
+
+cdef inline unsigned int _read_bit(BitReader *r) noexcept nogil:
+    cdef unsigned int value
+    if r.bit == 0:
+        # drop emulation prevention bytes (00 00 03) on the fly
+        if r.zeros >= 2 and r.pos < r.size and r.data[r.pos] == 3:
+            r.pos += 1
+            r.zeros = 0
+        if r.pos >= r.size:
+            r.overrun = True
+            return 0
+    value = (r.data[r.pos] >> (7 - r.bit)) & 1
+    r.bit += 1
+    if r.bit == 8:
+        r.zeros = r.zeros + 1 if r.data[r.pos] == 0 else 0
+        r.pos += 1
+        r.bit = 0
+    return value
+
+
+cdef inline unsigned int _read_bits(BitReader *r, int count) noexcept nogil:
+    cdef unsigned int value = 0
+    cdef int i
+    for i in range(count):
+        value = (value << 1) | _read_bit(r)
+    return value
+
+
+cdef inline unsigned int _read_ue(BitReader *r) noexcept nogil:
+    # exp-Golomb coded unsigned integer
+    cdef int leading_zeros = 0
+    while _read_bit(r) == 0:
+        leading_zeros += 1
+        if leading_zeros > 31 or r.overrun:
+            r.overrun = True
+            return 0
+    return ((<unsigned int>1) << leading_zeros) - 1 + _read_bits(r, leading_zeros)
+
+
+cdef inline int _read_se(BitReader *r) noexcept nogil:
+    cdef unsigned int value = _read_ue(r)
+    if value & 1:
+        return <int>((value + 1) >> 1)
+    return -<int>(value >> 1)
+
+
+cdef Py_ssize_t find_nal_start(const unsigned char *data, Py_ssize_t start, Py_ssize_t size) noexcept nogil:
+    '''
+    Returns the offset behind the next 00 00 01 start code or -1.
+    '''
+    cdef Py_ssize_t i = start
+    while i + 2 < size:
+        if data[i + 2] > 1:
+            i += 3
+        elif data[i + 2] == 1 and data[i + 1] == 0 and data[i] == 0:
+            return i + 3
+        else:
+            i += 1
+    return -1
+
+
+cdef inline Py_ssize_t _nal_end(const unsigned char *data, Py_ssize_t start, Py_ssize_t next_start, Py_ssize_t size) noexcept nogil:
+    cdef Py_ssize_t end = size if next_start == -1 else next_start - 3
+    # trailing_zero_8bits and the leading zero of 4 byte start codes
+    while end > start and data[end - 1] == 0:
+        end -= 1
+    return end
+
+
+cdef bint annexb_is_keyframe(const unsigned char *data, Py_ssize_t size) noexcept nogil:
+    '''
+    True if the first slice of the access unit is an IDR or an I slice.
+    '''
+    cdef Py_ssize_t start = find_nal_start(data, 0, size)
+    cdef Py_ssize_t next_start
+    cdef int nal_type
+    cdef unsigned int slice_type
+    cdef BitReader reader
+    while start != -1 and start < size:
+        next_start = find_nal_start(data, start, size)
+        nal_type = data[start] & 0x1F
+        if nal_type == NAL_UNIT_IDR:
+            return True
+        if nal_type == NAL_UNIT_SLICE:
+            _reader_init(&reader, data + start + 1, _nal_end(data, start, next_start, size) - start - 1)
+            _read_ue(&reader)  # first_mb_in_slice
+            slice_type = _read_ue(&reader)
+            return not reader.overrun and slice_type % 5 == 2
+        start = next_start
+    return False
+
+
+cdef bint annexb_is_idr(const unsigned char *data, Py_ssize_t size) noexcept nogil:
+    '''
+    True if the first slice of the access unit is an IDR slice.
+
+    Unlike other I slices, an IDR slice guarantees that no later frame refers to
+    a frame before it, i.e. it is a valid start of a recording.
+    '''
+    cdef Py_ssize_t start = find_nal_start(data, 0, size)
+    cdef int nal_type
+    while start != -1 and start < size:
+        nal_type = data[start] & 0x1F
+        if nal_type == NAL_UNIT_IDR:
+            return True
+        if nal_type == NAL_UNIT_SLICE:
+            return False
+        start = find_nal_start(data, start, size)
+    return False
+
+
+def index_nal_units(buffer):
+    '''
+    Returns a NALUnit for every NAL unit in an Annex-B buffer, in stream order.
+    '''
+    cdef const unsigned char[::1] view = memoryview(buffer).cast("B")
+    cdef Py_ssize_t size = view.shape[0]
+    cdef const unsigned char *data
+    cdef Py_ssize_t start, next_start, end
+    units = []
+    if size == 0:
+        return units
+    data = &view[0]
+    start = find_nal_start(data, 0, size)
+    while start != -1 and start < size:
+        next_start = find_nal_start(data, start, size)
+        end = _nal_end(data, start, next_start, size)
+        if end > start:
+            units.append(NALUnit(start, data[start] & 0x1F, end - start))
+        start = next_start
+    return units
+
+
+def is_keyframe(buffer):
+    '''
+    True if the access unit can start a stream: its first slice is IDR or I.
+    '''
+    cdef const unsigned char[::1] view = memoryview(buffer).cast("B")
+    if view.shape[0] == 0:
+        return False
+    cdef bint result
+    with nogil:
+        result = annexb_is_keyframe(&view[0], view.shape[0])
+    return result
+
+
+def is_idr(buffer):
+    '''
+    True if the first slice of the access unit is IDR, see `is_keyframe`.
+    '''
+    cdef const unsigned char[::1] view = memoryview(buffer).cast("B")
+    if view.shape[0] == 0:
+        return False
+    cdef bint result
+    with nogil:
+        result = annexb_is_idr(&view[0], view.shape[0])
+    return result
+
+
+def parameter_sets(buffer):
+    '''
+    Returns the first (SPS, PPS) NAL units of an Annex-B buffer as bytes.
+
+    Each one includes its NAL header byte and is None if it is not present.
+    '''
+    sps = pps = None
+    data = memoryview(buffer).cast("B")
+    for unit in index_nal_units(buffer):
+        if unit.type == NAL_UNIT_SPS and sps is None:
+            sps = bytes(data[unit.offset : unit.offset + unit.size])
+        elif unit.type == NAL_UNIT_PPS and pps is None:
+            pps = bytes(data[unit.offset : unit.offset + unit.size])
+        if sps is not None and pps is not None:
+            break
+    return sps, pps
+
+
+cdef void _skip_scaling_list(BitReader *r, int size) noexcept nogil:
+    cdef int last_scale = 8, next_scale = 8, j
+    for j in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + _read_se(r) + 256) % 256
+        if next_scale != 0:
+            last_scale = next_scale
+
+
+def parse_sps(nal_unit):
+    '''
+    Parses profile, level and cropped resolution from a SPS NAL unit.
+
+    nal_unit starts at the NAL header byte, as returned by parameter_sets().
+    Raises ValueError if it is not a SPS or if it is truncated.
+    '''
+    cdef const unsigned char[::1] view = memoryview(nal_unit).cast("B")
+    if view.shape[0] < 4 or (view[0] & 0x1F) != NAL_UNIT_SPS:
+        raise ValueError("Not a SPS NAL unit")
+
+    cdef BitReader r
+    cdef unsigned int profile_idc, level_idc, chroma_format_idc = 1
+    cdef unsigned int poc_type, cycle, width_mbs, height_map_units, i
+    cdef bint separate_colour_plane = False, frame_mbs_only
+    cdef unsigned int crop_left = 0, crop_right = 0, crop_top = 0, crop_bottom = 0
+    cdef unsigned int crop_unit_x, crop_unit_y
+    _reader_init(&r, &view[1], view.shape[0] - 1)
+
+    profile_idc = _read_bits(&r, 8)
+    _read_bits(&r, 8)  # constraint flags
+    level_idc = _read_bits(&r, 8)
+    _read_ue(&r)  # seq_parameter_set_id
+    if profile_idc in _HIGH_PROFILES:
+        chroma_format_idc = _read_ue(&r)
+        if chroma_format_idc == 3:
+            separate_colour_plane = _read_bit(&r)
+        _read_ue(&r)  # bit_depth_luma_minus8
+        _read_ue(&r)  # bit_depth_chroma_minus8
+        _read_bit(&r)  # qpprime_y_zero_transform_bypass_flag
+        if _read_bit(&r):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if _read_bit(&r):
+                    _skip_scaling_list(&r, 16 if i < 6 else 64)
+    _read_ue(&r)  # log2_max_frame_num_minus4
+    poc_type = _read_ue(&r)
+    if poc_type == 0:
+        _read_ue(&r)  # log2_max_pic_order_cnt_lsb_minus4
+    elif poc_type == 1:
+        _read_bit(&r)  # delta_pic_order_always_zero_flag
+        _read_se(&r)  # offset_for_non_ref_pic
+        _read_se(&r)  # offset_for_top_to_bottom_field
+        cycle = _read_ue(&r)
+        for i in range(cycle):
+            _read_se(&r)
+            if r.overrun:
+                break
+    _read_ue(&r)  # max_num_ref_frames
+    _read_bit(&r)  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = _read_ue(&r) + 1
+    height_map_units = _read_ue(&r) + 1
+    frame_mbs_only = _read_bit(&r)
+    if not frame_mbs_only:
+        _read_bit(&r)  # mb_adaptive_frame_field_flag
+    _read_bit(&r)  # direct_8x8_inference_flag
+    if _read_bit(&r):  # frame_cropping_flag
+        crop_left = _read_ue(&r)
+        crop_right = _read_ue(&r)
+        crop_top = _read_ue(&r)
+        crop_bottom = _read_ue(&r)
+    if r.overrun:
+        raise ValueError("Truncated SPS NAL unit")
+
+    if separate_colour_plane or chroma_format_idc == 0:
+        crop_unit_x = 1
+        crop_unit_y = 2 - frame_mbs_only
+    else:
+        crop_unit_x = 2 if chroma_format_idc in (1, 2) else 1
+        crop_unit_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+    width = width_mbs * 16 - (crop_left + crop_right) * crop_unit_x
+    height = (2 - frame_mbs_only) * height_map_units * 16
+    height -= (crop_top + crop_bottom) * crop_unit_y
+    return SPSInfo(profile_idc, level_idc, chroma_format_idc, width, height)
+
+
+def stream_info(buffer):
+    '''
+    Returns the SPSInfo of the first SPS in an Annex-B buffer or None.
+    '''
+    sps, _ = parameter_sets(buffer)
+    if sps is None:
+        return None
+    return parse_sps(sps)
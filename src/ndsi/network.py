@@ -14,6 +14,7 @@ import json as serial
 import logging
 import traceback as tb
 import typing
+import weakref
 
 import zmq
 from pyre import Pyre, PyreEvent
@@ -54,6 +55,12 @@ class NetworkInterface(abc.ABC):
     def sensors(self) -> typing.Mapping[str, NetworkSensor]:
         pass
 
+    @property
+    @abc.abstractmethod
+    def event_sockets(self) -> typing.List[zmq.Socket]:
+        """Sockets that become readable when there are events, e.g. for pollers."""
+        pass
+
     @property
     @abc.abstractmethod
     def callbacks(self) -> typing.Iterable[NetworkEventCallback]:
@@ -85,10 +92,70 @@ class NetworkInterface(abc.ABC):
     def handle_event(self):
         pass
 
+    @property
+    @abc.abstractmethod
+    def linked_sensors(self) -> typing.List[Sensor]:
+        """Sensors created by `sensor()` that have not been unlinked yet."""
+        pass
+
+    def poll(self, timeout=None, data: bool = False) -> typing.List[Sensor]:
+        """
+        Waits up to `timeout` ms for network events and notifications of the linked
+        sensors and handles the ones that arrived. With `data`, the data sockets of
+        the linked sensors are polled as well and the sensors with data ready are
+        returned.
+        """
+        event_sockets = self.event_sockets
+        sensors = self.linked_sensors
+        data_sensors = (
+            [s for s in sensors if s.supports_data_subscription] if data else []
+        )
+        sockets = event_sockets + [s.notify_sub for s in sensors]
+        sockets += [s.data_sub for s in data_sensors]
+        if any(sensor.has_buffered_data for sensor in data_sensors):
+            timeout = 0
+
+        ready = self._socket_poller.poll(sockets, timeout=timeout)
+
+        if any(socket in ready for socket in event_sockets):
+            while self.has_events:
+                self.handle_event()
+        for sensor in sensors:
+            # callbacks might have unlinked the sensor in the meantime
+            if sensor.notify_sub in ready and sensor.linked:
+                while sensor.has_notifications:
+                    sensor.handle_notification()
+        return [
+            sensor
+            for sensor in data_sensors
+            if sensor.linked and (sensor.data_sub in ready or sensor.has_buffered_data)
+        ]
+
+    def run_forever(
+        self,
+        on_data: typing.Optional[typing.Callable[[Sensor], None]] = None,
+        timeout=100,
+    ):
+        """
+        Handles events and notifications until the network is stopped. `on_data` is
+        called with every linked sensor that has data ready, e.g. to `fetch_data()`.
+        """
+        while self.running:
+            for sensor in self.poll(timeout=timeout, data=on_data is not None):
+                on_data(sensor)
+
     @abc.abstractmethod
     def sensor(
-        self, sensor_uuid: str, callbacks: typing.Iterable[NetworkEventCallback] = ()
+        self,
+        sensor_uuid: str,
+        callbacks: typing.Iterable[NetworkEventCallback] = (),
+        **sensor_options,
     ) -> Sensor:
+        """
+        Links the sensor. `sensor_options` are passed on to the init of the sensor
+        class, e.g. `gray_only` for video sensors or `backpressure` (see
+        `ndsi.sensor.BackpressurePolicy`) for any sensor with a data stream.
+        """
         pass
 
 
@@ -108,6 +175,8 @@ class _NetworkNode(NetworkInterface):
         self._pyre_node = None
         self._context = context or zmq.Context()
         self._sensors_by_host = {}
+        self._linked_sensors = weakref.WeakSet()
+        self._socket_poller = _SocketPoller()
         self._callbacks = [self._on_event] + list(callbacks)
 
     # Public NetworkInterface API
@@ -120,6 +189,14 @@ class _NetworkNode(NetworkInterface):
     def running(self) -> bool:
         return bool(self._pyre_node)
 
+    @property
+    def event_sockets(self) -> typing.List[zmq.Socket]:
+        return [self._pyre_node.socket()] if self.running else []
+
+    @property
+    def linked_sensors(self) -> typing.List[Sensor]:
+        return [sensor for sensor in self._linked_sensors if sensor.linked]
+
     @property
     def sensors(self) -> typing.Mapping[str, NetworkSensor]:
         sensors = {}
@@ -245,7 +322,10 @@ class _NetworkNode(NetworkInterface):
             logger.debug(f"Dropping {event}")
 
     def sensor(
-        self, sensor_uuid: str, callbacks: typing.Iterable[NetworkEventCallback] = ()
+        self,
+        sensor_uuid: str,
+        callbacks: typing.Iterable[NetworkEventCallback] = (),
+        **sensor_options,
     ) -> Sensor:
         try:
             sensor_settings = self.sensors[sensor_uuid].copy()
@@ -258,13 +338,16 @@ class _NetworkNode(NetworkInterface):
         if sensor_type is None:
             raise ValueError(f'Sensor of type "{sensor_type_str}" is not supported.')
 
-        return Sensor.create_sensor(
+        sensor = Sensor.create_sensor(
             sensor_type=sensor_type,
             format=self._format,
             context=self._context,
             callbacks=callbacks,
             **sensor_settings,
+            **sensor_options,
         )
+        self._linked_sensors.add(sensor)
+        return sensor
 
     # Public
 
@@ -331,6 +414,7 @@ class Network(NetworkInterface):
             for format in formats
         ]
         assert len(self._nodes) > 0
+        self._socket_poller = _SocketPoller()
 
     # Public NetworkInterface API
 
@@ -342,6 +426,14 @@ class Network(NetworkInterface):
     def running(self) -> bool:
         return any(node.running for node in self._nodes)
 
+    @property
+    def event_sockets(self) -> typing.List[zmq.Socket]:
+        return [socket for node in self._nodes for socket in node.event_sockets]
+
+    @property
+    def linked_sensors(self) -> typing.List[Sensor]:
+        return [sensor for node in self._nodes for sensor in node.linked_sensors]
+
     @property
     def sensors(self) -> typing.Mapping[str, NetworkSensor]:
         sensors = collections.ChainMap(*(n.sensors for n in self._nodes))
@@ -378,14 +470,39 @@ class Network(NetworkInterface):
             node.handle_event()
 
     def sensor(
-        self, sensor_uuid: str, callbacks: typing.Iterable[NetworkEventCallback] = ()
+        self,
+        sensor_uuid: str,
+        callbacks: typing.Iterable[NetworkEventCallback] = (),
+        **sensor_options,
     ) -> Sensor:
         for node in self._nodes:
             if sensor_uuid in node.sensors:
-                return node.sensor(sensor_uuid=sensor_uuid, callbacks=callbacks)
+                return node.sensor(
+                    sensor_uuid=sensor_uuid, callbacks=callbacks, **sensor_options
+                )
         raise ValueError(f'"{sensor_uuid}" is not an available sensor id.')
 
 
+class _SocketPoller:
+    """
+    `zmq.Poller` for POLLIN that is kept in sync with a changing set of sockets,
+    instead of registering every socket again for each poll.
+    """
+
+    def __init__(self):
+        self._poller = zmq.Poller()
+        self._sockets = set()
+
+    def poll(self, sockets: typing.Iterable[zmq.Socket], timeout) -> typing.Set:
+        sockets = set(sockets)
+        for socket in self._sockets - sockets:
+            self._poller.unregister(socket)
+        for socket in sockets - self._sockets:
+            self._poller.register(socket, zmq.POLLIN)
+        self._sockets = sockets
+        return {socket for socket, _ in self._poller.poll(timeout)}
+
+
 def group_name_from_format(format: DataFormat) -> str:
     return f"pupil-mobile-{format}"
 
@@ -9,12 +9,16 @@
 """
 
 import abc
+import collections
 import enum
 import json as serial
 import logging
+import queue
+import threading
 import traceback as tb
 import typing
 
+import numpy as np
 import zmq
 
 from ndsi import StreamError
@@ -30,10 +34,14 @@ from ndsi.formatter import (
     GazeValue,
     IMUDataFormatter,
     IMUValue,
+    UnsupportedFormatter,
     VideoDataFormatter,
     VideoValue,
 )
 
+if typing.TYPE_CHECKING:
+    from ndsi.shm import FrameRingPublisher
+
 logger = logging.getLogger(__name__)
 NANO = 1e-9
 
@@ -55,11 +63,58 @@ To add a new sensor, in `sensor.py`:
 4. (Optional) If the new `Sensor` subclass will include `SensorFetchDataMixin`, the
    subclass must define a property `formatter` that returns an instance of
    `DataFormatter` which serializes/deserializes the data handled by the sensor.
+   Use `SensorFetchBatchMixin` instead if the formatter implements
+   `decode_msgs_array`.
 5. Run the test suit to make sure that all the tests pass again.
 6. Write additional tests to cover the custom behaviour of the new sensor type.
 """
 
 
+@enum.unique
+class BackpressurePolicy(enum.Enum):
+    """
+    How a sensor's data subscription copes with a consumer that falls behind.
+
+    DEFAULT: ZMQ queues up to 3 messages and drops new ones while full.
+    LATEST: only the newest received message is kept, older ones are dropped on
+        every receive. ZMQ_CONFLATE is not used since it breaks multipart messages.
+    DROP_OLDEST: received messages are kept in a bounded queue of
+        `backpressure_queue_size` messages, the oldest ones are dropped.
+    LOSSLESS: large ZMQ queue and kernel receive buffer, nothing is dropped as
+        long as the consumer catches up eventually.
+
+    LATEST and DROP_OLDEST discard messages without decoding them. Video sensors
+    still pass dropped H264 packets to the decoder to keep the stream intact.
+    Their ZMQ queue is large, since ZMQ holds back or drops the newest messages
+    once it is full, before the policy sees them.
+    """
+
+    DEFAULT = "default"
+    LATEST = "latest"
+    DROP_OLDEST = "drop_oldest"
+    LOSSLESS = "lossless"
+
+    def socket_options(self, queue_size: int = 3) -> typing.Mapping[int, int]:
+        """ZMQ options of the data socket, `queue_size` as for DROP_OLDEST."""
+        if self in (BackpressurePolicy.LATEST, BackpressurePolicy.DROP_OLDEST):
+            # messages must reach the policy's queue to drop the oldest ones
+            return {zmq.RCVHWM: max(queue_size, _DROPPING_POLICY_RCVHWM)}
+        return _BACKPRESSURE_SOCKET_OPTIONS[self]
+
+
+# Messages a stalled consumer of the LATEST and DROP_OLDEST policies can fall
+# behind before ZMQ holds back the newest ones (ZMQ's default high water mark)
+_DROPPING_POLICY_RCVHWM = 1000
+
+_BACKPRESSURE_SOCKET_OPTIONS = {
+    BackpressurePolicy.DEFAULT: {zmq.RCVHWM: 3},
+    BackpressurePolicy.LOSSLESS: {
+        zmq.RCVHWM: 100_000,
+        zmq.RCVBUF: 8 * 1024 * 1024,
+    },
+}
+
+
 @enum.unique
 class SensorType(enum.Enum):
     HARDWARE = "hardware"
@@ -120,7 +175,14 @@ class Sensor:
         data_endpoint=None,
         context=None,
         callbacks=(),
+        backpressure: typing.Union[BackpressurePolicy, str] = "default",
+        backpressure_queue_size: int = 3,
     ):
+        """
+        `backpressure` selects the `BackpressurePolicy` of the data subscription.
+        Messages dropped by the LATEST and DROP_OLDEST policies are counted in
+        `dropped_messages`; drops inside ZMQ queues cannot be observed.
+        """
         self.format = format
         self.callbacks = [self.on_notification] + list(callbacks)
         self.context = context or zmq.Context()
@@ -134,6 +196,20 @@ class Sensor:
         self.data_endpoint = data_endpoint
         self.controls: typing.Dict[str, typing.Any] = {}
 
+        self.backpressure = BackpressurePolicy(backpressure)
+        self.dropped_messages = 0
+        if self.backpressure is BackpressurePolicy.LATEST:
+            self._pending_data = collections.deque(maxlen=1)
+        elif self.backpressure is BackpressurePolicy.DROP_OLDEST:
+            if backpressure_queue_size < 1:
+                raise ValueError("backpressure_queue_size must be at least 1")
+            self._pending_data = collections.deque(maxlen=backpressure_queue_size)
+        else:
+            self._pending_data = None
+        self._data_sub_options = self.backpressure.socket_options(
+            backpressure_queue_size
+        )
+
         self.notify_sub = context.socket(zmq.SUB)
         self.notify_sub.connect(self.notify_endpoint)
         self.notify_sub.subscribe(self.uuid)
@@ -147,13 +223,18 @@ class Sensor:
 
     def _init_data_sub(self, context):
         if self.data_endpoint:
-            self.data_sub = context.socket(zmq.SUB)
-            self.data_sub.set_hwm(3)
-            self.data_sub.connect(self.data_endpoint)
+            self.data_sub = self._data_sub_socket(context)
             self.data_sub.subscribe(self.uuid)
         else:
             self.data_sub = None
 
+    def _data_sub_socket(self, context):
+        data_sub = context.socket(zmq.SUB)
+        for option, value in self._data_sub_options.items():
+            data_sub.setsockopt(option, value)
+        data_sub.connect(self.data_endpoint)
+        return data_sub
+
     def unlink(self):
         self.notify_sub.unsubscribe(self.uuid)
         self.notify_sub.close(linger=0)
@@ -162,10 +243,23 @@ class Sensor:
             self.data_sub.unsubscribe(self.uuid)
             self.data_sub.close(linger=0)
 
+    @property
+    def linked(self) -> bool:
+        """False once `unlink()` was called."""
+        return not self.notify_sub.closed
+
     @property
     def supports_data_subscription(self):
         return bool(self.data_sub)
 
+    @property
+    def has_buffered_data(self) -> bool:
+        """
+        True if the queue of the LATEST or DROP_OLDEST backpressure policy holds
+        received messages. These are not signalled by polling the data socket.
+        """
+        return bool(self._pending_data)
+
     @property
     def has_notifications(self):
         has_n = self.notify_sub.get(zmq.EVENTS) & zmq.POLLIN
@@ -173,11 +267,22 @@ class Sensor:
 
     @property
     def has_data(self):
+        if self.has_buffered_data:
+            return True
         try:
             return self.data_sub.get(zmq.EVENTS) & zmq.POLLIN
         except AttributeError:
             raise NotDataSubSupportedError()
 
+    def poll_data(self, timeout=None) -> bool:
+        """Waits up to `timeout` ms for data, like `zmq.Socket.poll`."""
+        if self.has_buffered_data:
+            return True
+        try:
+            return bool(self.data_sub.poll(timeout=timeout))
+        except AttributeError:
+            raise NotDataSubSupportedError()
+
     def __str__(self):
         return f"<{__name__} {self.name}@{self.host_name} [{self.type}]>"
 
@@ -241,10 +346,43 @@ class Sensor:
                 pass
 
     def get_data(self, copy=True):
-        try:
-            return self.data_sub.recv_multipart(copy=copy)
-        except AttributeError:
+        if self.data_sub is None:
             raise NotDataSubSupportedError()
+        if self._pending_data is None:
+            return self.data_sub.recv_multipart(copy=copy)
+        self._drain_data_sub()
+        if self._pending_data:
+            data_msg = self._pending_data.popleft()
+        else:
+            data_msg = self.data_sub.recv_multipart(copy=False)
+        return [frame.bytes for frame in data_msg] if copy else data_msg
+
+    def _get_data_nowait(self):
+        """Returns the next message as `zmq.Frame`s, or None if there is none."""
+        if self._pending_data is None:
+            try:
+                return self.data_sub.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return None
+        if not self._pending_data:
+            self._drain_data_sub()
+        return self._pending_data.popleft() if self._pending_data else None
+
+    def _drain_data_sub(self):
+        pending_data = self._pending_data
+        recv_multipart = self.data_sub.recv_multipart
+        while True:
+            try:
+                data_msg = recv_multipart(flags=zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            if len(pending_data) == pending_data.maxlen:
+                self._drop_data_msg(pending_data[0])
+            pending_data.append(data_msg)
+
+    def _drop_data_msg(self, data_msg):
+        """Called for every message discarded by the backpressure policy."""
+        self.dropped_messages += 1
 
     def refresh_controls(self):
         cmd = serial.dumps({"action": "refresh_controls"})
@@ -313,26 +451,248 @@ class SensorFetchDataMixin(typing.Generic[SensorFetchDataValue], abc.ABC):
             yield from self.formatter.decode_msg(data_msg=data_msg)
 
 
+class SensorFetchBatchMixin(SensorFetchDataMixin[SensorFetchDataValue]):
+    """
+    Batch decoding for sensors whose formatter supports `decode_msgs_array`, i.e.
+    sensors of fixed-layout data.
+    """
+
+    def fetch_batch(self, max_messages: typing.Optional[int] = None) -> np.ndarray:
+        """
+        Receives up to `max_messages` queued messages (all of them if None) and
+        decodes them together into a structured array with one record per value,
+        see `ARRAY_DTYPE` of the sensor's formatter.
+        """
+        assert isinstance(self, Sensor)
+
+        if not self.supports_data_subscription:
+            raise NotDataSubSupportedError()
+        formatter = self.formatter
+        if isinstance(formatter, UnsupportedFormatter):
+            # check before receiving, the messages would be lost otherwise
+            raise ValueError(
+                f"Batch decoding of {self.type} data is not supported for data "
+                f"format {self.format}."
+            )
+
+        data_msgs = []
+        while max_messages is None or len(data_msgs) < max_messages:
+            data_msg = self._get_data_nowait()
+            if data_msg is None:
+                break
+            data_msgs.append(DataMessage(*data_msg))
+        return formatter.decode_msgs_array(data_msgs)
+
+
 class VideoSensor(SensorFetchDataMixin[VideoValue], Sensor):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        gray_only: bool = False,
+        passthrough: bool = False,
+        decoder_options: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+        **kwargs,
+    ):
+        """
+        `decoder_options` are passed on to the `FrameFactory` of this sensor, e.g.
+        `{"h264_color_format": ndsi.frame.H264_COLOR_FORMAT_NATIVE}`.
+        """
         super().__init__(*args, **kwargs)
         self._recent_frame = None
         self._waiting_for_iframe = True
-        self._formatter = VideoDataFormatter.get_formatter(format=self.format)
+        self._formatter = VideoDataFormatter.acquire_formatter(
+            format=self.format, **(decoder_options or {})
+        )
+        self.gray_only = gray_only
+        self.passthrough = passthrough
+        self._decode_thread = None
+        self._decode_stop = None
+        self._decoded_frames = None
 
     @property
     def formatter(self) -> VideoDataFormatter:
         return self._formatter
 
-    def get_newest_data_frame(self, timeout=None):
+    def unlink(self):
+        self.stop_background_decoding()
+        super().unlink()
+        if self._formatter is not None:
+            VideoDataFormatter.release_formatter(self._formatter)
+            self._formatter = None
+
+    @property
+    def gray_only(self) -> bool:
+        """
+        Luminance-only decoding of MJPEG frames, e.g. for eye cameras. Color outputs
+        of such frames contain the gray image in every channel.
+        """
+        return self._gray_only
+
+    @gray_only.setter
+    def gray_only(self, value: bool):
+        # kept on the sensor, the formatter is released by unlink()
+        self._gray_only = value
+        if self._formatter is not None:
+            self._formatter.gray_only = value
+
+    @property
+    def passthrough(self) -> bool:
+        """
+        Record-only mode: H264 data is yielded as `H264Packet`s without decoding.
+        """
+        return self._passthrough
+
+    @passthrough.setter
+    def passthrough(self, value: bool):
+        self._passthrough = value
+        if self._formatter is not None:
+            self._formatter.passthrough = value
+
+    @property
+    def background_decoding(self) -> bool:
+        return self._decode_thread is not None
+
+    def start_background_decoding(
+        self,
+        queue_size: int = 3,
+        conversions: typing.Iterable[str] = ("bgr",),
+        publisher: typing.Optional["FrameRingPublisher"] = None,
+    ):
+        """
+        Starts a worker thread that receives and decodes frames in the background.
+
+        `conversions` names the frame properties (e.g. "bgr", "gray", "yuv420")
+        that are computed by the worker before a frame is queued. The queue keeps
+        the `queue_size` newest frames; older frames are dropped.
+
+        With a `ndsi.shm.FrameRingPublisher`, every decoded frame is also written
+        to its shared memory ring, so that other processes can read the frames
+        without decoding the stream again.
+
+        While the worker runs, it is the only user of the data socket.
+        `fetch_data()` and `get_newest_data_frame()` return frames from the queue.
+        """
+        if not self.supports_data_subscription:
+            raise NotDataSubSupportedError()
+        if self.background_decoding:
+            return
+        self._decoded_frames = queue.Queue(maxsize=queue_size)
+        self._decode_stop = threading.Event()
+        self._decode_thread = threading.Thread(
+            target=self._decode_loop,
+            args=(
+                self._decode_stop,
+                self._decoded_frames,
+                tuple(conversions),
+                publisher,
+            ),
+            name=f"{self.name} decoder",
+            daemon=True,
+        )
+        self._decode_thread.start()
+
+    def stop_background_decoding(self):
+        if not self.background_decoding:
+            return
+        self._decode_stop.set()
+        self._decode_thread.join()
+        self._decode_thread = None
+        self._decode_stop = None
+        self._decoded_frames = None
+
+    def _decode_loop(self, stop_event, decoded_frames, conversions, publisher):
+        while not stop_event.is_set():
+            if not self.poll_data(timeout=100):
+                continue
+            try:
+                for frame in SensorFetchDataMixin.fetch_data(self):
+                    if stop_event.is_set():
+                        # checked per message, the data never runs dry if the
+                        # stream is faster than decoding
+                        break
+                    if frame is None:
+                        continue
+                    for conversion in conversions:
+                        getattr(frame, conversion)
+                    if publisher is not None:
+                        publisher.publish(frame)
+                    try:
+                        decoded_frames.put_nowait(frame)
+                    except queue.Full:
+                        # drop the oldest frame
+                        try:
+                            decoded_frames.get_nowait()
+                        except queue.Empty:
+                            pass
+                        decoded_frames.put_nowait(frame)
+            except Exception:
+                logger.debug(tb.format_exc())
+
+    def fetch_data(self) -> typing.Iterator[VideoValue]:
+        if not self.background_decoding:
+            yield from super().fetch_data()
+            return
+        decoded_frames = self._decoded_frames
+        while True:
+            try:
+                yield decoded_frames.get_nowait()
+            except queue.Empty:
+                return
+
+    def _drop_data_msg(self, data_msg):
+        super()._drop_data_msg(data_msg)
+        self.formatter.skip_msg(data_msg=DataMessage(*data_msg))
+
+    def _get_newest_data_msg(self) -> typing.Optional[DataMessage]:
+        """
+        Receives all queued messages without decoding them and returns the newest
+        one. Superseded messages only go through `VideoDataFormatter.skip_msg`, so
+        MJPEG frames are never created for them and H264 output is not converted.
+        """
+        newest_msg = None
+        while True:
+            data_msg = self._get_data_nowait()
+            if data_msg is None:
+                return newest_msg
+            if newest_msg is not None:
+                self.formatter.skip_msg(data_msg=newest_msg)
+            newest_msg = DataMessage(*data_msg)
+
+    def get_newest_data_frame(self, timeout=None, skip_backlog=True):
+        """
+        Returns the newest available frame, waiting up to `timeout` ms for one.
+
+        With `skip_backlog`, all queued messages are received first and only the
+        newest one is decoded, superseded ones go through
+        `VideoDataFormatter.skip_msg`. This bounds the time needed to catch up after
+        the consumer fell behind.
+        """
         if not self.supports_data_subscription:
             raise NotDataSubSupportedError()
 
-        if self.data_sub.poll(timeout=timeout):
-            newest_frame = None
+        if self.background_decoding:
+            try:
+                # timeout is given in milliseconds, like for zmq.Socket.poll
+                newest_frame = self._decoded_frames.get(
+                    timeout=None if timeout is None else timeout / 1000
+                )
+            except queue.Empty:
+                raise StreamError("Operation timed out.")
             for newest_frame in self.fetch_data():
-                # Get the last avaiable frame
                 pass
+            return newest_frame
+
+        if self.poll_data(timeout=timeout):
+            newest_frame = None
+            if skip_backlog:
+                newest_msg = self._get_newest_data_msg()
+                if newest_msg is not None:
+                    for newest_frame in self.formatter.decode_msg(newest_msg):
+                        pass
+            else:
+                for newest_frame in self.fetch_data():
+                    # Get the last avaiable frame
+                    pass
             if newest_frame is not None:
                 return newest_frame
             else:
@@ -348,27 +708,32 @@ class AnnotateSensor(SensorFetchDataMixin[AnnotateValue], Sensor):
 
     def _init_data_sub(self, context):
         if self.data_endpoint:
-            self.data_sub = context.socket(zmq.SUB)
-            self.data_sub.set_hwm(3)
-            self.data_sub.connect(self.data_endpoint)
+            self.data_sub = self._data_sub_socket(context)
             self.data_sub.subscribe("")
         else:
             self.data_sub = None
 
 
-class GazeSensor(SensorFetchDataMixin[GazeValue], Sensor):
+class GazeSensor(SensorFetchBatchMixin[GazeValue], Sensor):
     @property
     def formatter(self) -> GazeDataFormatter:
         return GazeDataFormatter.get_formatter(format=self.format)
 
 
-class IMUSensor(SensorFetchDataMixin[IMUValue], Sensor):
+class IMUSensor(SensorFetchBatchMixin[IMUValue], Sensor):
     @property
     def formatter(self) -> IMUDataFormatter:
         return IMUDataFormatter.get_formatter(format=self.format)
 
+    def fetch_data_array(self) -> np.ndarray:
+        """
+        Returns all available samples as one structured array, see
+        `IMUDataFormatter.ARRAY_DTYPE`. The array is empty if there is no data.
+        """
+        return self.fetch_batch()
+
 
-class EventSensor(SensorFetchDataMixin[EventValue], Sensor):
+class EventSensor(SensorFetchBatchMixin[EventValue], Sensor):
     @property
     def formatter(self) -> EventDataFormatter:
         return EventDataFormatter.get_formatter(format=self.format)
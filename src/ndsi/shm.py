@@ -0,0 +1,273 @@
+"""
+(*)~----------------------------------------------------------------------------------
+ Pupil - eye tracking platform
+ Copyright (C) 2012-2015  Pupil Labs
+
+ Distributed under the terms of the CC BY-NC-SA License.
+ License details are in the file LICENSE, distributed as part of this software.
+----------------------------------------------------------------------------------~(*)
+
+Shared memory ring buffer for decoded video frames.
+
+One process decodes a stream and publishes its frames with `FrameRingPublisher`.
+Other processes attach a `FrameRingReader` by name and read the frames as numpy
+views of the shared memory, without decoding or copying them again.
+
+Layout: a header, followed by the metadata of every slot and the slot images.
+Every slot is guarded by a sequence lock that is odd while the slot is written.
+Frames are numbered from 1, frame `n` is stored in slot `n % slots`.
+"""
+
+import logging
+import typing
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = 0x5253444E  # "NDSR"
+_VERSION = 1
+_ALIGNMENT = 64
+
+_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "<u4"),
+        ("version", "<u4"),
+        ("width", "<u4"),
+        ("height", "<u4"),
+        ("channels", "<u4"),
+        ("slots", "<u4"),
+        # sequence number of the newest complete frame, 0 before the first one
+        ("sequence", "<u8"),
+    ]
+)
+
+_SLOT_DTYPE = np.dtype(
+    [
+        ("lock", "<u8"),
+        ("sequence", "<u8"),
+        ("timestamp", "<f8"),
+        ("index", "<i8"),
+    ]
+)
+
+
+class RingFrame(typing.NamedTuple):
+    sequence: int
+    timestamp: float
+    index: int
+    image: np.ndarray
+
+
+def _aligned(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _layout(width: int, height: int, channels: int, slots: int):
+    """Returns the slot metadata offset, image offset, slot size and total size."""
+    meta_offset = _aligned(_HEADER_DTYPE.itemsize)
+    data_offset = meta_offset + _aligned(_SLOT_DTYPE.itemsize * slots)
+    slot_bytes = _aligned(width * height * channels)
+    return meta_offset, data_offset, slot_bytes, data_offset + slot_bytes * slots
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Shared memory frame rings require Python 3.8 or newer.")
+
+
+def _attach(name: str):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13, see FrameRingReader
+        return shared_memory.SharedMemory(name=name)
+
+
+class _FrameRing:
+    def __init__(self, shm, writeable: bool):
+        # kept after close(), e.g. for FrameRingPublisher.unlink()
+        self._shm = shm
+        self._closed = False
+        self._header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf)
+        self.width = int(self._header["width"])
+        self.height = int(self._header["height"])
+        self.channels = int(self._header["channels"])
+        self.slots = int(self._header["slots"])
+        meta_offset, data_offset, slot_bytes, _ = _layout(
+            self.width, self.height, self.channels, self.slots
+        )
+        self._slots = np.ndarray(
+            (self.slots,), dtype=_SLOT_DTYPE, buffer=shm.buf, offset=meta_offset
+        )
+        if self.channels == 1:
+            shape = (self.height, self.width)
+        else:
+            shape = (self.height, self.width, self.channels)
+        self._images = []
+        for slot in range(self.slots):
+            image = np.ndarray(
+                shape,
+                dtype=np.uint8,
+                buffer=shm.buf,
+                offset=data_offset + slot * slot_bytes,
+            )
+            image.flags.writeable = writeable
+            self._images.append(image)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def sequence(self) -> int:
+        """Sequence number of the newest published frame, 0 if there is none."""
+        return int(self._header["sequence"])
+
+    def close(self):
+        """
+        Detaches from the shared memory. Images returned by the ring must not be
+        referenced anymore.
+        """
+        if self._closed:
+            return
+        self._header = self._slots = self._images = None
+        self._shm.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FrameRingPublisher(_FrameRing):
+    """
+    Creates the shared memory ring `name` and writes frames into it.
+
+    `channels` is 3 for BGR and 1 for gray images. The ring holds `slots` frames;
+    readers have to be done with a frame before `slots - 1` newer frames have
+    been published. There must only be one publisher per ring.
+    """
+
+    def __init__(
+        self, name: str, width: int, height: int, channels: int = 3, slots: int = 8
+    ):
+        _require_shared_memory()
+        if channels not in (1, 3):
+            raise ValueError("channels must be 1 (gray) or 3 (BGR)")
+        if slots < 2:
+            raise ValueError("A frame ring needs at least 2 slots")
+        *_, size = _layout(width, height, channels, slots)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf)
+        header[()] = (_MAGIC, _VERSION, width, height, channels, slots, 0)
+        del header
+        super().__init__(shm, writeable=True)
+        self._slots[...] = 0
+
+    def publish(self, frame) -> int:
+        """
+        Decodes a `JPEGFrame` or `H264Frame` directly into the next slot.
+
+        Returns the sequence number of the published frame.
+        """
+        if (frame.width, frame.height) != (self.width, self.height):
+            raise ValueError(
+                f"Expected {self.width}x{self.height} frame, "
+                f"got {frame.width}x{frame.height}"
+            )
+        decode = frame.decode_gray if self.channels == 1 else frame.decode_bgr
+        return self._write(
+            lambda image: decode(out=image), frame.timestamp, frame.index
+        )
+
+    def write(self, image: np.ndarray, timestamp: float, index: int = 0) -> int:
+        """
+        Copies an image into the next slot.
+
+        Returns the sequence number of the written frame.
+        """
+        return self._write(lambda out: np.copyto(out, image), timestamp, index)
+
+    def _write(self, fill, timestamp: float, index: int) -> int:
+        sequence = self.sequence + 1
+        slot = sequence % self.slots
+        locks = self._slots["lock"]
+        locks[slot] += 1
+        try:
+            self._slots["sequence"][slot] = 0
+            fill(self._images[slot])
+            self._slots["timestamp"][slot] = timestamp
+            self._slots["index"][slot] = index
+            self._slots["sequence"][slot] = sequence
+        finally:
+            locks[slot] += 1
+        self._header["sequence"] = sequence
+        return sequence
+
+    def unlink(self):
+        """
+        Removes the shared memory, attached readers keep their mapping. Can be
+        called before or after `close()`.
+        """
+        self._shm.unlink()
+
+
+class FrameRingReader(_FrameRing):
+    """
+    Attaches to the shared memory ring `name` of a `FrameRingPublisher`.
+
+    Returned images are read-only views of the ring. They are only valid until
+    the publisher reuses their slot; check `is_valid()` after using one.
+
+    Before Python 3.13, attaching registers the ring with the resource tracker of
+    the reader, which unlinks it when the reader's process tree exits, see
+    https://bugs.python.org/issue39959. There, readers should run in the
+    publisher's process or its `multiprocessing` child processes, which share the
+    publisher's tracker.
+    """
+
+    def __init__(self, name: str):
+        _require_shared_memory()
+        shm = _attach(name)
+        header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf)
+        magic, version = int(header["magic"]), int(header["version"])
+        del header
+        if magic != _MAGIC or version != _VERSION:
+            shm.close()
+            raise ValueError(f"'{name}' is not a frame ring of version {_VERSION}")
+        super().__init__(shm, writeable=False)
+
+    def read(self, sequence: int) -> typing.Optional[RingFrame]:
+        """Returns frame `sequence`, or None if it is not (or no longer) available."""
+        if not 0 < sequence <= self.sequence:
+            return None
+        slot = sequence % self.slots
+        lock = int(self._slots["lock"][slot])
+        if lock % 2 == 1:
+            return None
+        timestamp = float(self._slots["timestamp"][slot])
+        index = int(self._slots["index"][slot])
+        if (
+            int(self._slots["sequence"][slot]) != sequence
+            or int(self._slots["lock"][slot]) != lock
+        ):
+            return None
+        return RingFrame(sequence, timestamp, index, self._images[slot])
+
+    def read_newest(self) -> typing.Optional[RingFrame]:
+        return self.read(self.sequence)
+
+    def is_valid(self, frame: RingFrame) -> bool:
+        """True if the slot of `frame` was not overwritten since it was read."""
+        slot = frame.sequence % self.slots
+        return (
+            int(self._slots["lock"][slot]) % 2 == 0
+            and int(self._slots["sequence"][slot]) == frame.sequence
+        )
@@ -14,7 +14,7 @@ from os import path, remove
 
 import numpy as np
 
-from ndsi.frame cimport H264Frame
+from ndsi.frame cimport H264Frame, H264Packet
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -45,8 +45,8 @@ cdef class H264Writer:
         if not self.proxy.isRunning():
             logger.error('Mp4Writer not running')
             return
-        if not isinstance(input_frame, H264Frame):
-            logger.error('Expected H264Frame but got {}'.format(type(input_frame)))
+        if not isinstance(input_frame, (H264Frame, H264Packet)):
+            logger.error('Expected H264Frame or H264Packet but got {}'.format(type(input_frame)))
             return
         if not self.width == input_frame.width:
             logger.error('Expected width {} but got {}'.format(self.width, input_frame.width))
@@ -60,7 +60,7 @@ cdef class H264Writer:
                 logger.debug('No I-frame found yet -- dropping frame.')
                 return
 
-        cdef unsigned char[:] buffer_ = input_frame.h264_buffer
+        cdef const unsigned char[:] buffer_ = input_frame.h264_buffer
         #we are using indexing pts instead of real pts
         # cdef long long pts = <long long>(input_frame.timestamp * 1e6)
         cdef long long pts = <long long>int((self.frame_count*1e6/self.fps))
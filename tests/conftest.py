@@ -0,0 +1,92 @@
+import fractions
+import json
+
+import pytest
+import zmq
+
+from ndsi.formatter import DataFormat
+from ndsi.sensor import Sensor, SensorType
+
+SENSOR_UUID = "6678360f-9850-468e-8b44-47b7c43712dc"
+
+
+class SensorStream:
+    """In-process host side of a sensor: notify, command and data sockets."""
+
+    def __init__(self, context, data_endpoint="inproc://data"):
+        self.context = context
+        self.data_pub = context.socket(zmq.PUB)
+        self.data_pub.bind(data_endpoint)
+        self.data_endpoint = self.data_pub.get(zmq.LAST_ENDPOINT).decode()
+        self.command_pull = context.socket(zmq.PULL)
+        self.command_pull.bind("inproc://command")
+        self.notify_pub = context.socket(zmq.PUB)
+        self.notify_pub.bind("inproc://notify")
+        self.sensors = []
+
+    def connect(
+        self, sensor_type=SensorType.GAZE, format=DataFormat.V4, **sensor_options
+    ) -> Sensor:
+        sensor = Sensor.create_sensor(
+            sensor_type=sensor_type,
+            format=format,
+            host_uuid="host",
+            host_name="host",
+            sensor_uuid=SENSOR_UUID,
+            sensor_name=str(sensor_type),
+            notify_endpoint="inproc://notify",
+            command_endpoint="inproc://command",
+            data_endpoint=self.data_endpoint,
+            context=self.context,
+            **sensor_options,
+        )
+        self.sensors.append(sensor)
+        return sensor
+
+    def publish(self, *data_msgs):
+        for header, body in data_msgs:
+            self.data_pub.send_multipart([SENSOR_UUID.encode(), header, body])
+
+    def notify(self, notification):
+        self.notify_pub.send_multipart(
+            [SENSOR_UUID.encode(), json.dumps(notification).encode()]
+        )
+
+    def close(self):
+        for sensor in self.sensors:
+            if not sensor.notify_sub.closed:
+                sensor.unlink()
+        self.context.destroy(linger=0)
+
+
+@pytest.fixture
+def sensor_stream():
+    stream = SensorStream(zmq.Context())
+    yield stream
+    stream.close()
+
+
+@pytest.fixture
+def tcp_sensor_stream():
+    """Like `sensor_stream`, with the data sent over tcp as by remote hosts."""
+    stream = SensorStream(zmq.Context(), data_endpoint="tcp://127.0.0.1:*")
+    yield stream
+    stream.close()
+
+
+@pytest.fixture(scope="session")
+def encode_jpeg():
+    """Returns a function that encodes BGR images like an MJPEG camera."""
+    av = pytest.importorskip("av")
+
+    def encode(image, pix_fmt="yuvj422p") -> bytes:
+        encoder = av.CodecContext.create("mjpeg", "w")
+        encoder.height, encoder.width = image.shape[:2]
+        encoder.pix_fmt = pix_fmt
+        encoder.time_base = fractions.Fraction(1, 30)
+        encoder.options = {"qmin": "1", "qmax": "1"}
+        frame = av.VideoFrame.from_ndarray(image, format="bgr24")
+        packets = encoder.encode(frame) + encoder.encode(None)
+        return bytes(packets[0])
+
+    return encode
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import struct
+
+import pytest
+
+from ndsi.aio import AsyncSensor
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def test_async_sensor_data(sensor_stream):
+    sensor = AsyncSensor(sensor_stream.connect())
+
+    async def first_values(count):
+        values = []
+        async for value in sensor.data():
+            values.append(value)
+            if len(values) == count:
+                return values
+
+    sensor_stream.notify(
+        {"subject": "update", "control_id": "streaming", "changes": {"value": True}}
+    )
+    header = struct.pack("<Q", 1_000_000_000)
+    sensor_stream.publish(*((header, struct.pack("<ff", x, 0)) for x in range(3)))
+    values = run(first_values(3))
+    assert [v.x for v in values] == [0, 1, 2]
+    assert sensor.controls["streaming"]["value"] is True
+
+
+def test_async_sensor_set_control_value(sensor_stream):
+    sensor = AsyncSensor(sensor_stream.connect())
+    # refresh_controls command sent by the sensor init
+    sensor_stream.command_pull.recv_multipart()
+
+    run(sensor.set_control_value("streaming", True))
+    sensor_uuid, command = sensor_stream.command_pull.recv_multipart()
+    assert sensor_uuid.decode() == sensor.uuid
+    assert json.loads(command) == {
+        "action": "set_control_value",
+        "control_id": "streaming",
+        "value": True,
+    }
+
+
+def test_async_sensor_frames_requires_video(sensor_stream):
+    sensor = AsyncSensor(sensor_stream.connect())
+
+    async def first_frame():
+        async for frame in sensor.frames():
+            return frame
+
+    with pytest.raises(TypeError):
+        run(first_frame())
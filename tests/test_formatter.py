@@ -1,23 +1,39 @@
 import collections
+import struct
 from datetime import datetime
 
 import numpy as np
 import pytest
+import zmq
 
+import ndsi.formatter
 from ndsi.formatter import (
     AnnotateDataFormatter,
     DataFormat,
     DataMessage,
+    EventDataFormatter,
+    EventValue,
     GazeDataFormatter,
     GazeValue,
     IMUDataFormatter,
+    IMUValue,
     UnsupportedFormatter,
     VideoDataFormatter,
 )
+from ndsi.frame import H264_COLOR_FORMAT_NATIVE
 
 DataFixture = collections.namedtuple("DataFixture", ["value", "data_msg"])
 
 
+@pytest.fixture(params=["python", "compiled"])
+def formatter_backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(ndsi.formatter, "_fastformat", None)
+    elif ndsi.formatter._fastformat is None:
+        pytest.skip("ndsi._fastformat is not available")
+    return request.param
+
+
 @pytest.fixture
 def gaze_v4_fixture() -> DataFixture:
     value = GazeValue(
@@ -51,12 +67,41 @@ def test_gaze_formatter():
         assert isinstance(gaze_formatter, (GazeDataFormatter, UnsupportedFormatter))
 
 
-def test_gaze_formatter_v4(gaze_v4_fixture: DataFixture):
+def test_gaze_formatter_v4(gaze_v4_fixture: DataFixture, formatter_backend):
     formatter_v4 = GazeDataFormatter.get_formatter(format=DataFormat.V4)
     decoded_value = formatter_v4.decode_msg(data_msg=gaze_v4_fixture.data_msg)
     assert next(decoded_value) == gaze_v4_fixture.value
 
 
+def test_gaze_formatter_v4_array_decoding(gaze_v4_fixture: DataFixture):
+    formatter_v4 = GazeDataFormatter.get_formatter(format=DataFormat.V4)
+    values = formatter_v4.decode_msgs_array([gaze_v4_fixture.data_msg] * 3)
+    assert values.dtype == GazeDataFormatter.ARRAY_DTYPE
+    assert len(values) == 3
+    for value in values:
+        assert GazeValue(*value) == gaze_v4_fixture.value
+    assert len(formatter_v4.decode_msgs_array([])) == 0
+
+
+def test_event_formatter_v4_array_decoding(formatter_backend):
+    formatter_v4 = EventDataFormatter.get_formatter(format=DataFormat.V4)
+    labels = [label.encode("utf-8") for label in ("start", "recording.begin", "üñí")]
+    data_msgs = [
+        DataMessage(
+            sensor_id=b"sensor",
+            header=struct.pack("<qii", 1_600_000_000_000_000_000 + i, len(label), 0),
+            body=zmq.Frame(label + b"\x00"),
+        )
+        for i, label in enumerate(labels)
+    ]
+    expected = [
+        value for msg in data_msgs for value in formatter_v4.decode_msg(data_msg=msg)
+    ]
+    values = formatter_v4.decode_msgs_array(data_msgs)
+    assert values.dtype == EventDataFormatter.ARRAY_DTYPE
+    assert [EventValue(*value) for value in values] == expected
+
+
 def test_annotate_formatter():
     for format in DataFormat.supported_formats():
         annotate_formatter = AnnotateDataFormatter.get_formatter(format=format)
@@ -71,10 +116,8 @@ def test_imu_formatter():
         assert isinstance(imu_formatter, (IMUDataFormatter, UnsupportedFormatter))
 
 
-def test_imu_formatter_v4_decoding():
-    imu_v4_fmt = IMUDataFormatter.get_formatter(format=DataFormat.V4)
-
-    data_msg = DataMessage(
+def imu_v4_data_msg():
+    return DataMessage(
         sensor_id=b"fa25fb2f-ab58-4058-990c-bcd49a67c3ce",
         header=(
             b"\x00\x00\x00\x00\x07\x00\x00\x00\x12\x00"
@@ -107,6 +150,11 @@ def test_imu_formatter_v4_decoding():
         ),
     )
 
+
+def test_imu_formatter_v4_decoding():
+    imu_v4_fmt = IMUDataFormatter.get_formatter(format=DataFormat.V4)
+    data_msg = imu_v4_data_msg()
+
     imu_vals = list(imu_v4_fmt.decode_msg(data_msg=data_msg))
     assert len(imu_vals) == 18
 
@@ -135,7 +183,97 @@ def test_imu_formatter_v4_decoding():
         assert -1 <= imu_val.gyro_z <= 1
 
 
+def test_imu_formatter_v4_array_decoding():
+    imu_v4_fmt = IMUDataFormatter.get_formatter(format=DataFormat.V4)
+    data_msg = imu_v4_data_msg()
+
+    samples = imu_v4_fmt.decode_msg_array(data_msg=data_msg)
+    assert samples.dtype == IMUDataFormatter.ARRAY_DTYPE
+    assert samples.dtype.names == IMUValue._fields
+    imu_vals = list(imu_v4_fmt.decode_msg(data_msg=data_msg))
+    assert [IMUValue(*sample) for sample in samples] == imu_vals
+
+    batch = imu_v4_fmt.decode_msgs_array([data_msg, data_msg])
+    assert np.array_equal(batch, np.concatenate([samples, samples]))
+    assert len(imu_v4_fmt.decode_msgs_array([])) == 0
+
+
 def test_video_formatter():
     for format in DataFormat.supported_formats():
         imu_formatter = VideoDataFormatter.get_formatter(format=format)
         assert isinstance(imu_formatter, (VideoDataFormatter, UnsupportedFormatter))
+
+
+def test_video_formatter_instances():
+    for format in DataFormat.supported_formats():
+        formatter_a = VideoDataFormatter.get_formatter(format=format)
+        formatter_b = VideoDataFormatter.get_formatter(format=format)
+        assert formatter_a is not formatter_b
+
+
+def test_video_formatter_pool():
+    for format in DataFormat.supported_formats():
+        formatter = VideoDataFormatter.acquire_formatter(format=format)
+        other = VideoDataFormatter.acquire_formatter(format=format)
+        assert formatter is not other
+        VideoDataFormatter.release_formatter(formatter)
+        assert VideoDataFormatter.acquire_formatter(format=format) is formatter
+        VideoDataFormatter.release_formatter(other)
+
+
+def test_video_formatter_pool_decoder_options():
+    format = DataFormat.latest()
+    native = VideoDataFormatter.acquire_formatter(
+        format=format, h264_color_format=H264_COLOR_FORMAT_NATIVE
+    )
+    VideoDataFormatter.release_formatter(native)
+    assert VideoDataFormatter.acquire_formatter(format=format) is not native
+    assert (
+        VideoDataFormatter.acquire_formatter(
+            format=format, h264_color_format=H264_COLOR_FORMAT_NATIVE
+        )
+        is native
+    )
+
+
+@pytest.mark.parametrize(
+    "format, header",
+    [
+        (DataFormat.V3, struct.pack("<LLLLdLL", 0x10, 1280, 720, 7, 1.5e9, 1024, 0)),
+        (DataFormat.V4, struct.pack("<LLLLQLL", 0x12, 1088, 1080, 8, 2**62, 512, 0)),
+    ],
+)
+def test_video_header_backend_parity(format, header, monkeypatch):
+    if ndsi.formatter._fastformat is None:
+        pytest.skip("ndsi._fastformat is not available")
+    data_msg = DataMessage(sensor_id=b"sensor", header=header, body=b"")
+    formatter = VideoDataFormatter.get_formatter(format=format)
+    compiled = formatter._decode_header(data_msg)
+    monkeypatch.setattr(ndsi.formatter, "_fastformat", None)
+    assert compiled == formatter._decode_header(data_msg)
+
+
+@pytest.mark.parametrize(
+    "format, data",
+    [
+        (DataFormat.V3, struct.pack("<Bd", 3, 1564499230.2196853)),
+        (DataFormat.V4, struct.pack("<BQ", 255, 1564499230219685300)),
+    ],
+)
+def test_annotate_backend_parity(format, data, monkeypatch):
+    if ndsi.formatter._fastformat is None:
+        pytest.skip("ndsi._fastformat is not available")
+    formatter = AnnotateDataFormatter.get_formatter(format=format)
+    data_msg = DataMessage(sensor_id=data, header=b"", body=b"")
+    compiled = list(formatter.decode_msg(data_msg=data_msg))
+    monkeypatch.setattr(ndsi.formatter, "_fastformat", None)
+    assert compiled == list(formatter.decode_msg(data_msg=data_msg))
+
+
+def test_compiled_backend_rejects_invalid_sizes(gaze_v4_fixture: DataFixture):
+    if ndsi.formatter._fastformat is None:
+        pytest.skip("ndsi._fastformat is not available")
+    formatter = GazeDataFormatter.get_formatter(format=DataFormat.V4)
+    data_msg = gaze_v4_fixture.data_msg._replace(body=b"\x00" * 4)
+    with pytest.raises(struct.error):
+        next(formatter.decode_msg(data_msg=data_msg))
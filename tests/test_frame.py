@@ -0,0 +1,428 @@
+import gc
+
+import numpy as np
+import pytest
+import zmq
+
+from ndsi.frame import (
+    H264_COLOR_FORMAT_NATIVE,
+    H264_COLOR_FORMAT_YUV420,
+    H264_COLOR_FORMAT_YUV422,
+    H264_THREAD_FRAME,
+    H264_THREAD_SLICE,
+    VIDEO_FRAME_FORMAT_H264,
+    VIDEO_FRAME_FORMAT_MJPEG,
+    FrameFactory,
+)
+
+WIDTH, HEIGHT = 320, 240
+JPEG_WIDTH, JPEG_HEIGHT = 64, 48
+
+
+def gradient_image(width, height):
+    """Smooth BGR test image, which JPEG compresses with little error."""
+    y, x = np.mgrid[0:height, 0:width]
+    return np.stack([x * 4, y * 5, (x + y) * 2], axis=-1).astype(np.uint8)
+
+
+JPEG_IMAGE = gradient_image(JPEG_WIDTH, JPEG_HEIGHT)
+
+
+def assert_close(image, expected, tolerance=8):
+    assert image.shape == expected.shape
+    assert np.abs(image.astype(int) - expected).max() <= tolerance
+
+
+@pytest.fixture(scope="module")
+def jpeg_data(encode_jpeg):
+    return encode_jpeg(JPEG_IMAGE)
+
+
+def create_jpeg_frame(buffer_, factory=None, **options):
+    factory = factory or FrameFactory()
+    meta_data = (
+        VIDEO_FRAME_FORMAT_MJPEG,
+        JPEG_WIDTH,
+        JPEG_HEIGHT,
+        7,
+        1_500_000,
+        len(buffer_),
+        0,
+    )
+    return factory.create_jpeg_frame(buffer_, meta_data, **options)
+
+
+def test_jpeg_frame_decodes(jpeg_data):
+    frame = create_jpeg_frame(jpeg_data)
+    assert (frame.width, frame.height) == (JPEG_WIDTH, JPEG_HEIGHT)
+    assert (frame.index, frame.timestamp) == (7, 1.5)
+    assert_close(frame.bgr, JPEG_IMAGE)
+    assert frame.img is frame.bgr
+
+
+def test_jpeg_frame_references_buffer(jpeg_data):
+    buffer_ = bytearray(jpeg_data)
+    frame = create_jpeg_frame(buffer_)
+    assert np.shares_memory(frame.jpeg_buffer, np.frombuffer(buffer_, np.uint8))
+    assert not frame.jpeg_buffer.flags.writeable
+
+
+def test_jpeg_frame_keeps_zmq_frame_alive(jpeg_data):
+    zmq_frame = zmq.Frame(jpeg_data)
+    frame = create_jpeg_frame(zmq_frame)
+    del zmq_frame
+    gc.collect()
+    assert frame.jpeg_buffer.tobytes() == jpeg_data
+    assert_close(frame.bgr, JPEG_IMAGE)
+
+
+def test_jpeg_frame_copy_detaches_buffer(jpeg_data):
+    buffer_ = bytearray(jpeg_data)
+    frame = create_jpeg_frame(buffer_, copy=True)
+    assert not np.shares_memory(frame.jpeg_buffer, np.frombuffer(buffer_, np.uint8))
+    buffer_[:] = bytes(len(buffer_))  # e.g. reused for the next message
+    assert frame.jpeg_buffer.tobytes() == jpeg_data
+    assert_close(frame.bgr, JPEG_IMAGE)
+
+
+def encode_h264(pix_fmt):
+    av = pytest.importorskip("av")
+
+    encoder = av.CodecContext.create("libx264", "w")
+    encoder.width = WIDTH
+    encoder.height = HEIGHT
+    encoder.pix_fmt = pix_fmt
+    encoder.max_b_frames = 0
+    encoder.gop_size = 30
+
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    packets = []
+    for index in range(60):
+        image = np.roll(background, 4 * index, axis=1)
+        frame = av.VideoFrame.from_ndarray(image, format="bgr24")
+        packets.extend(bytes(p) for p in encoder.encode(frame))
+    packets.extend(bytes(p) for p in encoder.encode(None))
+    return packets
+
+
+@pytest.fixture(scope="module")
+def h264_packets():
+    return encode_h264("yuv420p")
+
+
+@pytest.fixture(scope="module")
+def h264_444_packets():
+    return encode_h264("yuv444p")
+
+
+def packet_meta_data(index, packet):
+    time_us = index * 33_333
+    return (VIDEO_FRAME_FORMAT_H264, WIDTH, HEIGHT, index, time_us, len(packet), 0)
+
+
+def decode_all(packets, **decoder_options):
+    factory = FrameFactory(**decoder_options)
+    frames = []
+    for index, packet in enumerate(packets):
+        meta_data = packet_meta_data(index, packet)
+        frames.extend(factory.create_h264_frames(packet, meta_data))
+    return frames
+
+
+@pytest.mark.parametrize("scale", [1 / 2, 1 / 4, 1 / 8])
+def test_jpeg_scaled_decoding(jpeg_data, scale):
+    frame = create_jpeg_frame(jpeg_data)
+    step = round(1 / scale)
+    # block averages of the full image are what the scaled IDCT approximates
+    blocks = JPEG_IMAGE.reshape(JPEG_HEIGHT // step, step, JPEG_WIDTH // step, step, 3)
+    expected = blocks.mean(axis=(1, 3)).round().astype(np.uint8)
+    bgr = frame.bgr_scaled(scale)
+    assert_close(bgr, expected, tolerance=16)
+    assert frame.bgr_scaled(scale) is bgr
+    gray = frame.gray_scaled(scale)
+    assert gray.shape == expected.shape[:2]
+    assert_close(gray, frame.gray[::step, ::step], tolerance=24)
+
+
+def test_jpeg_scaled_decoding_at_full_scale(jpeg_data):
+    frame = create_jpeg_frame(jpeg_data)
+    assert frame.bgr_scaled(1) is frame.bgr
+    assert frame.gray_scaled(1) is frame.gray
+
+
+@pytest.mark.parametrize("scale", [1 / 3, 0, 3])
+def test_jpeg_scaled_decoding_rejects_unsupported_scales(jpeg_data, scale):
+    frame = create_jpeg_frame(jpeg_data)
+    with pytest.raises(ValueError):
+        frame.bgr_scaled(scale)
+
+
+def test_jpeg_rgb_and_rgba(jpeg_data):
+    frame = create_jpeg_frame(jpeg_data)
+    assert np.array_equal(frame.rgb, frame.bgr[..., ::-1])
+    rgba = frame.rgba
+    assert rgba.shape == (JPEG_HEIGHT, JPEG_WIDTH, 4)
+    assert np.array_equal(rgba[..., :3], frame.rgb)
+    assert (rgba[..., 3] == 255).all()
+
+
+@pytest.mark.parametrize("pix_fmt", ["yuvj420p", "yuvj422p", "yuvj444p"])
+def test_jpeg_direct_decoding_matches_yuv_conversion(encode_jpeg, pix_fmt):
+    jpeg_data = encode_jpeg(JPEG_IMAGE, pix_fmt=pix_fmt)
+    direct = create_jpeg_frame(jpeg_data)
+    bgr, gray = direct.bgr, direct.gray
+    assert_close(bgr, JPEG_IMAGE, tolerance=16)
+
+    # accessing the planes first decodes to YUV and converts from there
+    via_yuv = create_jpeg_frame(jpeg_data)
+    assert via_yuv.yuv_buffer is not None
+    # the upsampling of the chroma planes differs slightly
+    assert_close(via_yuv.bgr, bgr, tolerance=4)
+    assert np.array_equal(via_yuv.gray, gray)
+
+
+def test_jpeg_gray_only_decoding(jpeg_data):
+    factory = FrameFactory()
+    factory.gray_only = True
+    frame = create_jpeg_frame(jpeg_data, factory)
+    assert frame.gray_only
+    gray = frame.gray
+    assert np.array_equal(gray, create_jpeg_frame(jpeg_data).gray)
+    for image in (frame.bgr, frame.rgb, frame.rgba[..., :3]):
+        assert image.shape == (JPEG_HEIGHT, JPEG_WIDTH, 3)
+        assert (image == gray[..., np.newaxis]).all()
+    assert (frame.rgba[..., 3] == 255).all()
+
+    out = np.empty((JPEG_HEIGHT, JPEG_WIDTH, 3), dtype=np.uint8)
+    assert frame.decode_bgr(out=out) is out
+    assert np.array_equal(out, frame.bgr)
+
+
+def test_jpeg_gray_only_scaled_decoding(jpeg_data):
+    factory = FrameFactory()
+    factory.gray_only = True
+    frame = create_jpeg_frame(jpeg_data, factory)
+    gray = frame.gray_scaled(1 / 2)
+    bgr = frame.bgr_scaled(1 / 2)
+    assert bgr.shape == (JPEG_HEIGHT // 2, JPEG_WIDTH // 2, 3)
+    assert (bgr == gray[..., np.newaxis]).all()
+
+
+@pytest.mark.parametrize("decoded", ["nothing", "yuv", "packed"])
+def test_jpeg_decode_into_output_buffers(jpeg_data, decoded):
+    expected = create_jpeg_frame(jpeg_data)
+    frame = create_jpeg_frame(jpeg_data)
+    # decoding into out uses the planes or images decoded before
+    if decoded == "yuv":
+        assert frame.yuv_buffer is not None
+    elif decoded == "packed":
+        frame.bgr, frame.gray
+
+    out = np.zeros((JPEG_HEIGHT, JPEG_WIDTH, 3), dtype=np.uint8)
+    assert frame.decode_bgr(out=out) is out
+    assert_close(out, expected.bgr, tolerance=4)
+
+    flat = bytearray(JPEG_WIDTH * JPEG_HEIGHT)
+    assert frame.decode_gray(out=flat) is flat
+    gray = np.frombuffer(flat, dtype=np.uint8).reshape(JPEG_HEIGHT, JPEG_WIDTH)
+    assert np.array_equal(gray, expected.gray)
+    assert np.array_equal(frame.decode_gray(), expected.gray)
+
+
+@pytest.mark.parametrize(
+    "out",
+    [
+        np.empty((JPEG_HEIGHT, JPEG_WIDTH), dtype=np.uint8),
+        np.empty((JPEG_HEIGHT, JPEG_WIDTH, 3), dtype=np.float32),
+        np.empty((JPEG_WIDTH, JPEG_HEIGHT, 3), dtype=np.uint8),
+        np.empty((JPEG_HEIGHT, JPEG_WIDTH, 6), dtype=np.uint8)[:, :, ::2],
+        bytes(JPEG_WIDTH * JPEG_HEIGHT * 3),
+    ],
+)
+def test_jpeg_decode_rejects_invalid_output_buffers(jpeg_data, out):
+    frame = create_jpeg_frame(jpeg_data)
+    with pytest.raises(ValueError):
+        frame.decode_bgr(out=out)
+
+
+@pytest.mark.parametrize("thread_type", [H264_THREAD_SLICE, H264_THREAD_FRAME])
+def test_h264_multithreaded_decoding_matches_single_threaded(h264_packets, thread_type):
+    reference = decode_all(h264_packets)
+    threaded = decode_all(
+        h264_packets, h264_thread_count=4, h264_thread_type=thread_type
+    )
+    assert len(reference) > 0
+    # frame threading delays the output, the sequence of frames must not change
+    assert 0 < len(threaded) <= len(reference)
+    for expected, actual in zip(reference, threaded):
+        assert actual.timestamp == expected.timestamp
+        assert np.array_equal(
+            np.asarray(actual.yuv_buffer), np.asarray(expected.yuv_buffer)
+        )
+
+
+def test_h264_frames_have_increasing_pts(h264_packets):
+    frames = decode_all(h264_packets)
+    timestamps = [frame.timestamp for frame in frames]
+    assert len(timestamps) == len(set(timestamps))
+    assert timestamps == sorted(timestamps)
+
+
+def test_h264_decode_into_output_buffers(h264_packets):
+    frame = decode_all(h264_packets)[0]
+    out = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    assert frame.decode_bgr(out=out) is out
+    assert np.array_equal(out, frame.bgr)
+
+    flat = bytearray(WIDTH * HEIGHT)
+    assert frame.decode_gray(out=flat) is flat
+    gray = np.frombuffer(flat, dtype=np.uint8).reshape(HEIGHT, WIDTH)
+    assert np.array_equal(gray, frame.gray)
+
+
+@pytest.mark.parametrize(
+    "out",
+    [
+        np.empty((HEIGHT, WIDTH), dtype=np.uint8),
+        np.empty((HEIGHT, WIDTH, 3), dtype=np.float32),
+        np.empty((WIDTH, HEIGHT, 3), dtype=np.uint8),
+        np.empty((HEIGHT, WIDTH, 6), dtype=np.uint8)[:, :, ::2],
+        bytes(WIDTH * HEIGHT * 3),
+    ],
+)
+def test_h264_decode_rejects_invalid_output_buffers(h264_packets, out):
+    frame = decode_all(h264_packets)[0]
+    with pytest.raises(ValueError):
+        frame.decode_bgr(out=out)
+
+
+def reference_planes(packets):
+    """Y, U, V planes of the packets decoded by PyAV."""
+    av = pytest.importorskip("av")
+
+    decoder = av.CodecContext.create("h264", "r")
+    frames = []
+    for packet in packets + [None]:
+        for frame in decoder.decode(packet and av.Packet(packet)):
+            planes = []
+            for plane in frame.planes:
+                array = np.frombuffer(plane, dtype=np.uint8)
+                array = array.reshape(plane.height, plane.line_size)
+                planes.append(array[:, : plane.width])
+            frames.append(planes)
+    return frames
+
+
+def test_h264_color_formats(h264_packets):
+    yuv422 = decode_all(h264_packets, h264_color_format=H264_COLOR_FORMAT_YUV422)
+    yuv420 = decode_all(h264_packets, h264_color_format=H264_COLOR_FORMAT_YUV420)
+    native = decode_all(h264_packets, h264_color_format=H264_COLOR_FORMAT_NATIVE)
+    reference = reference_planes(h264_packets)
+    assert len(yuv422) == len(yuv420) == len(native) == len(reference)
+    for frame_422, frame_420, frame_native, planes in zip(
+        yuv422, yuv420, native, reference
+    ):
+        assert len(frame_422.yuv_buffer) == WIDTH * HEIGHT * 2
+        assert len(frame_420.yuv_buffer) == WIDTH * HEIGHT * 3 // 2
+        # the stream is yuv420p, which is passed through without conversion
+        assert np.array_equal(frame_native.yuv_buffer, frame_420.yuv_buffer)
+        for plane, expected in zip(frame_native.yuv420, planes):
+            assert np.array_equal(plane, expected)
+
+
+def test_h264_yuv_planes(h264_packets):
+    frame_422 = decode_all(h264_packets)[0]
+    Y, U, V = frame_422.yuv422
+    assert np.array_equal(Y, frame_422.gray)
+    assert U.shape == V.shape == (HEIGHT, WIDTH // 2)
+    Y_420, U_420, V_420 = frame_422.yuv420
+    assert np.array_equal(Y_420, Y)
+    assert np.array_equal(U_420, U[::2])
+    assert np.array_equal(V_420, V[::2])
+
+    frame_420 = decode_all(h264_packets, h264_color_format=H264_COLOR_FORMAT_YUV420)[0]
+    Y, U, V = frame_420.yuv420
+    assert np.array_equal(Y, frame_420.gray)
+    assert U.shape == V.shape == (HEIGHT // 2, WIDTH // 2)
+    with pytest.raises(Exception):
+        frame_420.yuv422
+
+
+def test_h264_native_yuv444(h264_444_packets):
+    native = decode_all(h264_444_packets, h264_color_format=H264_COLOR_FORMAT_NATIVE)
+    reference = reference_planes(h264_444_packets)
+    assert len(native) == len(reference) > 0
+    for frame, (Y, U, V) in zip(native, reference):
+        assert len(frame.yuv_buffer) == WIDTH * HEIGHT * 3
+        assert frame.bgr.shape == (HEIGHT, WIDTH, 3)
+        # the properties drop chroma samples for the subsampled layouts
+        for plane, expected in zip(frame.yuv422, (Y, U[:, ::2], V[:, ::2])):
+            assert np.array_equal(plane, expected)
+        for plane, expected in zip(frame.yuv420, (Y, U[::2, ::2], V[::2, ::2])):
+            assert np.array_equal(plane, expected)
+
+
+def test_h264_skipped_packets_keep_decoder_state(h264_packets):
+    reference = decode_all(h264_packets)
+    factory = FrameFactory()
+    frames = []
+    for index, packet in enumerate(h264_packets):
+        meta_data = packet_meta_data(index, packet)
+        if 5 <= index < 25:
+            # catching up, the P-frames are still needed as references
+            assert factory.skip_h264_packet(packet, meta_data) is None
+        else:
+            frames.extend(factory.create_h264_frames(packet, meta_data))
+    assert len(frames) == len(reference) - 20
+    for frame, expected in zip(frames, reference[:5] + reference[25:]):
+        assert frame.timestamp == expected.timestamp
+        assert np.array_equal(frame.yuv_buffer, expected.yuv_buffer)
+
+
+def test_h264_buffer_pool_reuses_released_buffers(h264_packets):
+    factory = FrameFactory()
+    for index, packet in enumerate(h264_packets):
+        meta_data = packet_meta_data(index, packet)
+        for frame in factory.create_h264_frames(packet, meta_data):
+            frame.bgr
+    pool = factory.buffer_pool
+    assert pool.hits > 0
+    assert 0 < pool.pooled_bytes <= pool.max_bytes
+
+
+def test_h264_buffer_pool_keeps_referenced_buffers(h264_packets):
+    factory = FrameFactory()
+    images = []
+    for index, packet in enumerate(h264_packets):
+        meta_data = packet_meta_data(index, packet)
+        for frame in factory.create_h264_frames(packet, meta_data):
+            image = frame.bgr
+            gray = frame.gray
+            images.append((image, image.copy(), gray, gray.copy()))
+    for image, expected, gray, expected_gray in images:
+        assert np.array_equal(image, expected)
+        assert np.array_equal(gray, expected_gray)
+    assert factory.buffer_pool.hits == 0
+
+
+def test_h264_buffer_pool_can_be_disabled(h264_packets):
+    factory = FrameFactory(buffer_pool_bytes=0)
+    for index, packet in enumerate(h264_packets):
+        meta_data = packet_meta_data(index, packet)
+        for frame in factory.create_h264_frames(packet, meta_data):
+            frame.bgr
+            frame.clear_caches()
+    assert factory.buffer_pool.hits == 0
+    assert factory.buffer_pool.pooled_bytes == 0
+
+
+def test_h264_packet_iframe_requires_idr():
+    factory = FrameFactory()
+    # first_mb_in_slice=0, slice_type=7 (I), as IDR and as non-IDR slice
+    idr = bytes.fromhex("000000016588840021")
+    non_idr_i = bytes.fromhex("000000012188")
+    assert factory.create_h264_packet(idr, packet_meta_data(0, idr)).is_iframe
+    assert not factory.create_h264_packet(
+        non_idr_i, packet_meta_data(1, non_idr_i)
+    ).is_iframe
@@ -0,0 +1,136 @@
+import logging
+import struct
+import threading
+import time
+
+import pytest
+
+from ndsi import StreamError
+from ndsi.group import MAX_MESSAGES_PER_TASK, SensorGroup
+from ndsi.sensor import BackpressurePolicy
+
+GAZE_HEADER = struct.pack("<Q", 1_000_000_000)
+
+
+def gaze_msgs(*values):
+    return [(GAZE_HEADER, struct.pack("<ff", x, 0)) for x in values]
+
+
+def test_group_keeps_order_per_sensor(sensor_stream):
+    sensors = [sensor_stream.connect() for _ in range(4)]
+    received = {sensor: [] for sensor in sensors}
+    complete = threading.Event()
+    lock = threading.Lock()
+
+    def on_value(sensor, value):
+        with lock:
+            received[sensor].append(value.x)
+            if all(len(values) == 50 for values in received.values()):
+                complete.set()
+
+    with SensorGroup(sensors, callbacks=(on_value,), max_workers=3) as group:
+        assert group.running
+        for x in range(50):
+            sensor_stream.publish(*gaze_msgs(x))
+        assert complete.wait(timeout=5)
+    assert not group.running
+    for values in received.values():
+        assert values == list(range(50))
+
+
+def test_group_merged_queue(sensor_stream):
+    sensors = [sensor_stream.connect() for _ in range(2)]
+    with SensorGroup(sensors) as group:
+        sensor_stream.publish(*gaze_msgs(1, 2))
+        values = [group.get(timeout=5000) for _ in range(4)]
+        with pytest.raises(StreamError):
+            group.get(timeout=0)
+    for sensor in sensors:
+        assert [v.x for s, v in values if s is sensor] == [1, 2]
+
+
+def test_group_remove(sensor_stream):
+    sensors = [sensor_stream.connect() for _ in range(2)]
+    with SensorGroup(sensors) as group:
+        group.remove(sensors[0])
+        assert group.sensors == sensors[1:]
+        sensor_stream.publish(*gaze_msgs(1))
+        sensor, value = group.get(timeout=5000)
+        assert sensor is sensors[1]
+        with pytest.raises(StreamError):
+            group.get(timeout=100)
+
+
+def test_group_callback_errors_do_not_drop_values(sensor_stream, caplog):
+    sensor = sensor_stream.connect()
+    received = []
+    complete = threading.Event()
+
+    def failing(sensor, value):
+        if value.x == 0:
+            raise RuntimeError("callback failed")
+
+    def on_value(sensor, value):
+        received.append(value.x)
+        if len(received) == 3:
+            complete.set()
+
+    with SensorGroup([sensor], callbacks=(failing, on_value)):
+        sensor_stream.publish(*gaze_msgs(0, 1, 2))
+        assert complete.wait(timeout=5)
+    assert received == [0, 1, 2]
+    errors = [r for r in caplog.records if r.levelno >= logging.ERROR]
+    assert len(errors) == 1
+    assert "callback failed" in errors[0].exc_text
+
+
+def test_group_requeues_sensors_with_buffered_data(sensor_stream):
+    # all messages are moved into the backpressure queue by the first task, which
+    # the data socket does not signal any more
+    sensor = sensor_stream.connect(
+        backpressure=BackpressurePolicy.DROP_OLDEST, backpressure_queue_size=1000
+    )
+    count = 2 * MAX_MESSAGES_PER_TASK + 50
+    received = []
+    complete = threading.Event()
+
+    def on_value(sensor, value):
+        received.append(value.x)
+        if len(received) == count:
+            complete.set()
+
+    sensor_stream.publish(*gaze_msgs(*range(count)))
+    assert sensor.poll_data(timeout=1000)
+    with SensorGroup([sensor], callbacks=(on_value,)):
+        assert complete.wait(timeout=5)
+    assert received == list(range(count))
+
+
+def test_group_stops_under_sustained_input(sensor_stream):
+    sensor = sensor_stream.connect()
+    received = threading.Event()
+
+    def on_value(sensor, value):
+        time.sleep(0.001)  # slower than the stream
+        received.set()
+
+    publishing = threading.Event()
+    publishing.set()
+
+    def publish():
+        while publishing.is_set():
+            sensor_stream.publish(*gaze_msgs(0))
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    try:
+        group = SensorGroup([sensor], callbacks=(on_value,))
+        group.start()
+        assert received.wait(timeout=5)
+        stopper = threading.Thread(target=group.stop)
+        stopper.start()
+        stopper.join(timeout=5)
+        assert not stopper.is_alive()
+    finally:
+        publishing.clear()
+        publisher.join()
@@ -0,0 +1,80 @@
+import pytest
+
+from ndsi.nal import (
+    NALUnit,
+    SPSInfo,
+    index_nal_units,
+    is_idr,
+    is_keyframe,
+    parameter_sets,
+    parse_sps,
+    stream_info,
+)
+
+# Baseline 1920x1080 (cropped from 1088) and High 640x480
+SPS_BASELINE_1080P = bytes.fromhex("6742c028da01e0089f95")
+SPS_HIGH_480P = bytes.fromhex("6764001facd940a03d90")
+PPS = bytes.fromhex("68ce3c80")
+# first_mb_in_slice=0, slice_type=7 (I) / 5 (P)
+IDR_SLICE = bytes.fromhex("6588840021")
+I_SLICE = bytes.fromhex("2188")
+P_SLICE = bytes.fromhex("419a")
+
+
+def annexb(*units):
+    return b"".join(b"\x00\x00\x00\x01" + unit for unit in units)
+
+
+def test_index_nal_units():
+    buffer = annexb(SPS_BASELINE_1080P, PPS) + b"\x00\x00\x01" + IDR_SLICE + b"\x00"
+    assert index_nal_units(buffer) == [
+        NALUnit(4, 7, len(SPS_BASELINE_1080P)),
+        NALUnit(18, 8, len(PPS)),
+        NALUnit(25, 5, len(IDR_SLICE)),
+    ]
+    assert index_nal_units(b"") == []
+    assert index_nal_units(b"\x01\x02\x03") == []
+
+
+def test_parameter_sets():
+    buffer = annexb(SPS_HIGH_480P, PPS, IDR_SLICE)
+    assert parameter_sets(buffer) == (SPS_HIGH_480P, PPS)
+    assert parameter_sets(annexb(P_SLICE)) == (None, None)
+
+
+@pytest.mark.parametrize(
+    "sps, expected",
+    [
+        (SPS_BASELINE_1080P, SPSInfo(66, 40, 1, 1920, 1080)),
+        (SPS_HIGH_480P, SPSInfo(100, 31, 1, 640, 480)),
+    ],
+)
+def test_parse_sps(sps, expected):
+    assert parse_sps(sps) == expected
+    assert stream_info(annexb(sps, PPS, IDR_SLICE)) == expected
+
+
+def test_parse_sps_rejects_invalid_units():
+    with pytest.raises(ValueError):
+        parse_sps(PPS)
+    with pytest.raises(ValueError):
+        parse_sps(SPS_BASELINE_1080P[:6])
+    assert stream_info(annexb(P_SLICE)) is None
+
+
+def test_is_keyframe():
+    assert is_keyframe(annexb(SPS_BASELINE_1080P, PPS, IDR_SLICE))
+    assert is_keyframe(annexb(I_SLICE))
+    assert not is_keyframe(annexb(P_SLICE))
+    assert not is_keyframe(annexb(SPS_BASELINE_1080P, PPS))
+    assert not is_keyframe(b"")
+
+
+def test_is_idr():
+    assert is_idr(annexb(SPS_BASELINE_1080P, PPS, IDR_SLICE))
+    # non-IDR I slices may be followed by frames that refer to earlier ones
+    assert not is_idr(annexb(I_SLICE))
+    assert not is_idr(annexb(I_SLICE, IDR_SLICE))
+    assert not is_idr(annexb(P_SLICE))
+    assert not is_idr(annexb(SPS_BASELINE_1080P, PPS))
+    assert not is_idr(b"")
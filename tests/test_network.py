@@ -1,5 +1,7 @@
+import struct
+
 from ndsi.formatter import DataFormat
-from ndsi.network import group_name_from_format
+from ndsi.network import _NetworkNode, group_name_from_format
 
 
 def test_group_name():
@@ -17,3 +19,58 @@ def test_group_name():
     # Public spec
     assert group_name_from_format(DataFormat.V3) == "pupil-mobile-v3"
     assert group_name_from_format(DataFormat.V4) == "pupil-mobile-v4"
+
+
+def test_poll_dispatches_ready_sockets(sensor_stream):
+    node = _NetworkNode(format=DataFormat.V4, context=sensor_stream.context)
+    sensor = sensor_stream.connect()
+    node._linked_sensors.add(sensor)
+    assert node.poll(timeout=0, data=True) == []
+
+    sensor_stream.notify(
+        {"subject": "update", "control_id": "streaming", "changes": {"value": True}}
+    )
+    sensor_stream.publish((struct.pack("<Q", 0), struct.pack("<ff", 0, 0)))
+    assert node.poll(timeout=1000, data=False) == []
+    assert sensor.controls["streaming"]["value"] is True
+
+    assert node.poll(timeout=1000, data=True) == [sensor]
+    assert len(list(sensor.fetch_data())) == 1
+    assert node.poll(timeout=0, data=True) == []
+
+    sensor.unlink()
+    assert node.linked_sensors == []
+    assert node.poll(timeout=0, data=True) == []
+
+
+def test_poll_keeps_sockets_registered(sensor_stream, monkeypatch):
+    node = _NetworkNode(format=DataFormat.V4, context=sensor_stream.context)
+    sensor = sensor_stream.connect()
+    node._linked_sensors.add(sensor)
+    poller = node._socket_poller._poller
+    register = poller.register
+    registered = []
+
+    def counting_register(socket, flags):
+        registered.append(socket)
+        register(socket, flags)
+
+    monkeypatch.setattr(poller, "register", counting_register)
+    for _ in range(3):
+        node.poll(timeout=0, data=True)
+    assert len(registered) == 2
+    assert set(registered) == {sensor.notify_sub, sensor.data_sub}
+
+
+def test_poll_returns_sensors_with_buffered_data(sensor_stream):
+    node = _NetworkNode(format=DataFormat.V4, context=sensor_stream.context)
+    sensor = sensor_stream.connect(backpressure="drop_oldest")
+    node._linked_sensors.add(sensor)
+    sensor_stream.publish(
+        *((struct.pack("<Q", 0), struct.pack("<ff", x, 0)) for x in range(2))
+    )
+    assert sensor.poll_data(timeout=1000)
+    sensor.get_data()
+    # the second message was received into the backpressure queue
+    assert sensor.has_buffered_data
+    assert node.poll(timeout=0, data=True) == [sensor]
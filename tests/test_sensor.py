@@ -1,4 +1,12 @@
-from ndsi.sensor import Sensor, SensorType
+import struct
+import threading
+import time
+
+import pytest
+
+from ndsi.formatter import DataFormat, DataMessage, GazeDataFormatter, IMUDataFormatter
+from ndsi.frame import VIDEO_FRAME_FORMAT_MJPEG
+from ndsi.sensor import BackpressurePolicy, Sensor, SensorType
 
 
 def test_supported_types():
@@ -25,3 +33,209 @@ def test_sensor_factory():
     for sensor_type in SensorType.supported_types():
         sensor_class = Sensor.class_for_type(sensor_type=sensor_type)
         assert issubclass(sensor_class, Sensor)
+
+
+def gaze_msgs(*values):
+    header = struct.pack("<Q", 1_000_000_000)
+    return [(header, struct.pack("<ff", x, 0)) for x in values]
+
+
+def test_backpressure_policies(sensor_stream):
+    sensors = {
+        policy: sensor_stream.connect(backpressure=policy, backpressure_queue_size=2)
+        for policy in BackpressurePolicy
+    }
+    sensor_stream.publish(*gaze_msgs(0.0))
+    for sensor in sensors.values():
+        assert sensor.poll_data(timeout=1000)
+        assert [v.x for v in sensor.fetch_data()] == [0.0]
+
+    sensor_stream.publish(*gaze_msgs(1.0, 2.0, 3.0))
+    for sensor in sensors.values():
+        assert sensor.poll_data(timeout=1000)
+    received = {
+        policy: [v.x for v in sensor.fetch_data()] for policy, sensor in sensors.items()
+    }
+    assert received[BackpressurePolicy.LATEST] == [3.0]
+    assert received[BackpressurePolicy.DROP_OLDEST] == [2.0, 3.0]
+    assert received[BackpressurePolicy.LOSSLESS] == [1.0, 2.0, 3.0]
+    assert sensors[BackpressurePolicy.LATEST].dropped_messages == 2
+    assert sensors[BackpressurePolicy.DROP_OLDEST].dropped_messages == 1
+    assert sensors[BackpressurePolicy.LOSSLESS].dropped_messages == 0
+
+
+@pytest.mark.parametrize(
+    "policy", [BackpressurePolicy.LATEST, BackpressurePolicy.DROP_OLDEST]
+)
+def test_backpressure_policies_keep_newest_of_stalled_consumer(
+    tcp_sensor_stream, policy
+):
+    # unlike inproc, tcp does not add the sender's queue to the receive queue, so
+    # ZMQ holds back the newest messages once the data socket's queue is full
+    sensor = tcp_sensor_stream.connect(backpressure=policy, backpressure_queue_size=5)
+    while not sensor.poll_data(timeout=10):
+        tcp_sensor_stream.publish(*gaze_msgs(-1.0))
+    while sensor.poll_data(timeout=100):
+        list(sensor.fetch_data())
+
+    tcp_sensor_stream.publish(*gaze_msgs(*range(500)))
+    time.sleep(0.5)  # the consumer stalls while the messages arrive
+    value = next(sensor.fetch_data())
+    if policy is BackpressurePolicy.LATEST:
+        assert value.x == 499
+    else:
+        assert value.x == 495
+
+
+def test_backpressure_policy_from_str(sensor_stream):
+    sensor = sensor_stream.connect(backpressure="latest")
+    assert sensor.backpressure is BackpressurePolicy.LATEST
+    with pytest.raises(ValueError):
+        sensor_stream.connect(backpressure="foo")
+
+
+def video_msgs(*indices):
+    return [
+        (struct.pack("<LLLLQLL", VIDEO_FRAME_FORMAT_MJPEG, 8, 8, i, i, 1, 0), b"x")
+        for i in indices
+    ]
+
+
+def test_video_newest_data_msg_skips_superseded(sensor_stream, monkeypatch):
+    sensor = sensor_stream.connect(sensor_type=SensorType.VIDEO)
+    skipped = []
+    monkeypatch.setattr(
+        sensor.formatter, "skip_msg", lambda data_msg: skipped.append(data_msg)
+    )
+    sensor_stream.publish(*video_msgs(1, 2, 3))
+    assert sensor.poll_data(timeout=1000)
+    newest_msg = sensor._get_newest_data_msg()
+    assert sensor.formatter._decode_header(newest_msg)[3] == 3
+    assert [sensor.formatter._decode_header(m)[3] for m in skipped] == [1, 2]
+    assert sensor._get_newest_data_msg() is None
+
+
+def test_video_latest_policy_skips_dropped(sensor_stream, monkeypatch):
+    sensor = sensor_stream.connect(sensor_type=SensorType.VIDEO, backpressure="latest")
+    skipped = []
+    monkeypatch.setattr(
+        sensor.formatter, "skip_msg", lambda data_msg: skipped.append(data_msg)
+    )
+    sensor_stream.publish(*video_msgs(1, 2, 3))
+    assert sensor.poll_data(timeout=1000)
+    newest_msg = DataMessage(*sensor.get_data(copy=False))
+    assert sensor.formatter._decode_header(newest_msg)[3] == 3
+    assert len(skipped) == sensor.dropped_messages == 2
+
+
+def test_video_gray_only_survives_unlink(sensor_stream):
+    sensor = sensor_stream.connect(sensor_type=SensorType.VIDEO, gray_only=True)
+    assert sensor.gray_only and sensor.formatter.gray_only
+    sensor.gray_only = False
+    assert not sensor.formatter.gray_only
+    sensor.gray_only = True
+    sensor.unlink()
+    assert sensor.formatter is None
+    assert sensor.gray_only
+    sensor.gray_only = False
+    assert not sensor.gray_only
+
+
+def test_video_passthrough_survives_unlink(sensor_stream):
+    sensor = sensor_stream.connect(sensor_type=SensorType.VIDEO, passthrough=True)
+    assert sensor.passthrough and sensor.formatter.passthrough
+    sensor.unlink()
+    assert sensor.passthrough
+    sensor.passthrough = False
+    assert not sensor.passthrough
+
+
+def test_video_background_decoding_stops_under_sustained_input(
+    sensor_stream, monkeypatch
+):
+    sensor = sensor_stream.connect(sensor_type=SensorType.VIDEO)
+
+    def slow_decode_msg(data_msg):
+        time.sleep(0.001)
+        return [data_msg]
+
+    monkeypatch.setattr(sensor.formatter, "decode_msg", slow_decode_msg)
+    publishing = threading.Event()
+    publishing.set()
+
+    def publish():
+        index = 0
+        while publishing.is_set():
+            sensor_stream.publish(*video_msgs(index))
+            index += 1
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    try:
+        sensor.start_background_decoding(conversions=())
+        assert sensor.get_newest_data_frame(timeout=1000) is not None
+        stopper = threading.Thread(target=sensor.stop_background_decoding)
+        stopper.start()
+        stopper.join(timeout=5)
+        assert not stopper.is_alive()
+    finally:
+        publishing.clear()
+        publisher.join()
+
+
+def test_fetch_batch(sensor_stream):
+    sensor = sensor_stream.connect()
+    sensor_stream.publish(*gaze_msgs(0, 1, 2, 3, 4))
+    assert sensor.poll_data(timeout=1000)
+    assert sensor.fetch_batch(max_messages=2)["x"].tolist() == [0, 1]
+    values = sensor.fetch_batch()
+    assert values["x"].tolist() == [2, 3, 4]
+    assert values["timestamp"].tolist() == [1.0] * 3
+    empty = sensor.fetch_batch()
+    assert empty.shape == (0,)
+    assert empty.dtype == GazeDataFormatter.ARRAY_DTYPE
+
+
+def test_fetch_batch_takes_backpressure_queue_first(sensor_stream):
+    sensor = sensor_stream.connect(
+        backpressure=BackpressurePolicy.DROP_OLDEST, backpressure_queue_size=3
+    )
+    sensor_stream.publish(*gaze_msgs(0, 1, 2, 3))
+    assert sensor.poll_data(timeout=1000)
+    # receives all messages into the queue, drops 0 and returns 1
+    first = DataMessage(*sensor.get_data(copy=False))
+    assert struct.unpack("<ff", first.body)[0] == 1
+    assert sensor.dropped_messages == 1
+    assert sensor.fetch_batch()["x"].tolist() == [2, 3]
+    assert not sensor.has_data
+
+
+def test_imu_fetch_data_array(sensor_stream):
+    sensor = sensor_stream.connect(sensor_type=SensorType.IMU)
+    samples = [
+        struct.pack("<Q6f", 2_000_000_000 + i, *range(i, i + 6)) for i in range(3)
+    ]
+    sensor_stream.publish((b"", samples[0] + samples[1]), (b"", samples[2]))
+    assert sensor.poll_data(timeout=1000)
+    values = sensor.fetch_data_array()
+    assert values.dtype == IMUDataFormatter.ARRAY_DTYPE
+    assert values["accel_x"].tolist() == [0, 1, 2]
+    assert values["gyro_z"].tolist() == [5, 6, 7]
+    assert len(sensor.fetch_data_array()) == 0
+
+
+def test_fetch_batch_unsupported_format(sensor_stream):
+    sensor = sensor_stream.connect(format=DataFormat.V3)
+    sensor_stream.publish(*gaze_msgs(0))
+    assert sensor.poll_data(timeout=1000)
+    with pytest.raises(ValueError):
+        sensor.fetch_batch()
+    # nothing was received
+    assert sensor.has_data
+
+
+def test_fetch_batch_only_for_fixed_layout_sensors():
+    for sensor_type in (SensorType.GAZE, SensorType.IMU, SensorType.EVENT):
+        assert hasattr(Sensor.class_for_type(sensor_type), "fetch_batch")
+    for sensor_type in (SensorType.VIDEO, SensorType.ANNOTATE):
+        assert not hasattr(Sensor.class_for_type(sensor_type), "fetch_batch")
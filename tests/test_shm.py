@@ -0,0 +1,120 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from ndsi.frame import VIDEO_FRAME_FORMAT_MJPEG, FrameFactory
+from ndsi.shm import FrameRingPublisher, FrameRingReader, shared_memory
+
+pytestmark = pytest.mark.skipif(
+    shared_memory is None, reason="multiprocessing.shared_memory is not available"
+)
+
+WIDTH, HEIGHT = 8, 6
+
+
+@pytest.fixture
+def publisher():
+    publisher = FrameRingPublisher(ring_name(), WIDTH, HEIGHT, slots=3)
+    yield publisher
+    publisher.close()
+    publisher.unlink()
+
+
+def ring_name():
+    return f"ndsi-test-{uuid.uuid4().hex[:8]}"
+
+
+def image(value):
+    return np.full((HEIGHT, WIDTH, 3), value, dtype=np.uint8)
+
+
+def test_reader_sees_published_frames(publisher):
+    with FrameRingReader(publisher.name) as reader:
+        assert (reader.width, reader.height, reader.channels) == (WIDTH, HEIGHT, 3)
+        assert reader.read_newest() is None
+
+        sequence = publisher.write(image(7), timestamp=1.5, index=42)
+        frame = reader.read_newest()
+        assert frame.sequence == sequence == 1
+        assert (frame.timestamp, frame.index) == (1.5, 42)
+        assert np.array_equal(frame.image, image(7))
+        assert not frame.image.flags.writeable
+        assert reader.is_valid(frame)
+        del frame
+
+
+def test_reader_detects_overwritten_frames(publisher):
+    with FrameRingReader(publisher.name) as reader:
+        publisher.write(image(1), timestamp=1.0)
+        frame = reader.read(1)
+        for value in range(2, 5):
+            publisher.write(image(value), timestamp=float(value))
+        assert not reader.is_valid(frame)
+        assert reader.read(1) is None
+        assert reader.read(5) is None
+        newest = reader.read_newest()
+        assert newest.sequence == 4
+        assert np.array_equal(newest.image, image(4))
+        del frame, newest
+
+
+def test_reader_rejects_other_shared_memory():
+    shm = shared_memory.SharedMemory(create=True, size=4096)
+    try:
+        with pytest.raises(ValueError):
+            FrameRingReader(shm.name)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_publisher_unlink_after_close():
+    name = ring_name()
+    publisher = FrameRingPublisher(name, WIDTH, HEIGHT, slots=3)
+    publisher.close()
+    publisher.close()
+    assert publisher.name == name
+    publisher.unlink()
+    with pytest.raises(FileNotFoundError):
+        FrameRingReader(name)
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+def test_publisher_decodes_frames_into_slots(encode_jpeg, channels):
+    width, height = 16, 8
+    y, x = np.mgrid[0:height, 0:width]
+    bgr = np.stack([x * 16, y * 32, x + y], axis=-1).astype(np.uint8)
+    jpeg_data = encode_jpeg(bgr)
+    meta_data = (
+        VIDEO_FRAME_FORMAT_MJPEG,
+        width,
+        height,
+        3,
+        2_000_000,
+        len(jpeg_data),
+        0,
+    )
+    frame = FrameFactory().create_jpeg_frame(jpeg_data, meta_data)
+    expected = frame.gray if channels == 1 else frame.bgr
+
+    publisher = FrameRingPublisher(ring_name(), width, height, channels, slots=2)
+    try:
+        with FrameRingReader(publisher.name) as reader:
+            assert publisher.publish(frame) == 1
+            published = reader.read_newest()
+            assert (published.timestamp, published.index) == (2.0, 3)
+            assert np.array_equal(published.image, expected)
+            del published
+    finally:
+        publisher.close()
+        publisher.unlink()
+
+
+def test_publisher_rejects_frames_of_other_size(encode_jpeg, publisher):
+    jpeg_data = encode_jpeg(np.zeros((HEIGHT, 2 * WIDTH, 3), dtype=np.uint8))
+    meta_data = (VIDEO_FRAME_FORMAT_MJPEG, 2 * WIDTH, HEIGHT, 0, 0, len(jpeg_data), 0)
+    frame = FrameFactory().create_jpeg_frame(jpeg_data, meta_data)
+    with pytest.raises(ValueError):
+        publisher.publish(frame)
+    assert publisher.sequence == 0